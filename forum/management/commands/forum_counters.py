@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from forum.models import Forum, Thread
+
+
+class Command(BaseCommand):
+    help = 'Recounts the threads and responses of every forum and thread, for after posts are edited by hand'
+
+    def handle(self, *args, **options):
+        Thread.rebuild_counters()
+        Forum.rebuild_counters()
+        self.stdout.write(self.style.SUCCESS('Rebuilt counters for {} forums and {} threads'.format(
+            Forum.objects.count(), Thread.objects.count())))
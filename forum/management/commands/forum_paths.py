@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from forum.models import Forum
+
+
+class Command(BaseCommand):
+    help = 'Works out the path of every forum from its parents, for after forums are edited by hand'
+
+    def handle(self, *args, **options):
+        Forum.rebuild_paths()
+        Forum.rebuild_recursive_counts()
+        self.stdout.write(self.style.SUCCESS('Rebuilt paths for {} forums'.format(Forum.objects.count())))
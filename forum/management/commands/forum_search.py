@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from forum import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the forum search index from every thread and response'
+
+    def handle(self, *args, **options):
+        if not search.available():
+            self.stdout.write(self.style.WARNING('Forum search needs an SQLite database'))
+            return
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Indexed {} posts'.format(count)))
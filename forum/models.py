@@ -1,12 +1,39 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import BooleanField, Case, Count, F, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Concat, Substr
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
+from django.dispatch import receiver
 from django.shortcuts import reverse
+from django.utils import timezone
+from django.utils.safestring import mark_safe
 
+from templatetags.rendering import render
 from users.models import Member
+from . import search
+from .recent import forget_recent
+from .tree import get_tree, forget_tree
 
 body_size = 32768
 
 
-class Forum(models.Model):
+class Denormalised(models.Model):
+    """A model with denormalised fields, which are only ever changed in the database so saving leaves them alone"""
+    denormalised = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            skipped = set(self.denormalised) | self.get_deferred_fields()
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in skipped
+                                       and field.attname not in skipped]
+        super().save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
+class Forum(Denormalised):
     parent = models.ForeignKey(
         'self',
         on_delete=models.CASCADE,
@@ -19,26 +46,31 @@ class Forum(models.Model):
     title = models.CharField(max_length=64, verbose_name="Name")
     description = models.CharField(max_length=256, blank=True)
 
+    # Kept up to date as posts are made and deleted, see the receivers below
+    thread_count = models.IntegerField(default=0, editable=False)
+    # threads here and in all subforums
+    thread_count_r = models.IntegerField(default=0, editable=False)
+    response_count = models.IntegerField(default=0, editable=False)
+    latest_thread = models.ForeignKey('Thread', on_delete=models.SET_NULL, blank=True, null=True,
+                                      editable=False, related_name='+')
+    last_activity = models.DateTimeField(blank=True, null=True, editable=False)
+    # ids of the forum and every forum above it, root first, as "1/5/12/"
+    path = models.CharField(max_length=255, default='', editable=False, db_index=True)
+    denormalised = ('thread_count', 'thread_count_r', 'response_count', 'latest_thread', 'last_activity', 'path')
+
     def __str__(self):
         return self.title
 
+    def clean(self):
+        if self.id is not None and self.parent_id is not None and self.id in get_tree().ancestry(self.parent_id):
+            raise ValidationError({'parent': "A forum can't be inside itself"})
+
+    def get_path_ids(self):
+        return [int(forum_id) for forum_id in self.path.split('/') if forum_id]
+
+    # the forums above this one, root first, from the tree cache
     def get_parents(self):
-        if self.parent is None:
-            return []
-        tree = []
-        seen = {}
-        # walk up through tree to root
-        x = self.parent
-        while True:
-            tree.append(x)
-            seen[x.pk] = True
-            if x.parent is not None and x.parent.pk not in seen:
-                # traverse upwards
-                x = x.parent
-            else:
-                # reached root or loop parent
-                break
-        return reversed(tree)
+        return get_tree().parents(self.id)
 
     # string that represents the forum's location
     # eg "Roleplaying / LARP / Character Sheets"
@@ -57,42 +89,124 @@ class Forum(models.Model):
 
     # list of string representations of subforums
     def get_subforums_str(self):
-        return [str(x) for x in self.get_subforums()]
+        return [str(x) for x in get_tree().children(self.id)]
 
     get_subforums.short_description = 'Subforums'
     get_subforums_str.short_description = 'Subforums'
 
+    # QuerySet of forums anywhere below this one
+    def get_descendants(self):
+        return Forum.objects.filter(path__startswith=self.path).exclude(id=self.id)
+
     @staticmethod
     def get_parentless_forums():
         return Forum.objects.filter(parent__isnull=True)
 
     def get_threads_count(self):
-        return Thread.objects.filter(forum=self.id).count()
+        return self.thread_count
 
     get_threads_count.short_description = 'threads'
 
-    # recursively get thread count
+    # recursive thread count
     # i.e. number of threads here and in all subforums
-    def get_threads_count_r(self, seen=None):
-        if seen is None:
-            seen = {self.pk: True}
-        count = 0
-        for subforum in self.get_subforums():
-            if not subforum.pk in seen:
-                seen[subforum.pk] = True
-                count += subforum.get_threads_count_r(seen)
-        return count + self.get_threads_count()
+    def get_threads_count_r(self):
+        return self.thread_count_r
 
     def get_latest_post(self):
-        return self.thread_set.latest('pub_date')
+        return self.latest_thread
+
+    @staticmethod
+    def get_ancestry(forum_id):
+        """Ids of a forum and every forum above it, root first, from the tree cache"""
+        return get_tree().ancestry(forum_id)
+
+    def update_path(self):
+        """Works out this forum's path from its parent's, moving the paths of everything below it along too"""
+        parent_path = ''
+        if self.parent_id is not None:
+            parent_path = Forum.objects.values_list('path', flat=True).get(id=self.parent_id)
+        if str(self.id) in parent_path.split('/'):
+            raise ValueError("A forum can't be inside itself")
+        path = '{}{}/'.format(parent_path, self.id)
+        old_path = Forum.objects.values_list('path', flat=True).get(id=self.id)
+        if path != old_path:
+            Forum.objects.filter(id=self.id).update(path=path)
+            if old_path:
+                Forum.objects.filter(path__startswith=old_path).exclude(id=self.id).update(
+                    path=Concat(Value(path), Substr('path', len(old_path) + 1)))
+        self.path = path
+
+    @staticmethod
+    def rebuild_paths():
+        """Works out every forum's path from scratch, moving forums that are inside themselves to the top level"""
+        forums = list(Forum.objects.only('id', 'parent_id', 'path').order_by('id'))
+        parents = {forum.id: forum.parent_id for forum in forums}
+        for forum in forums:
+            ancestry = []
+            forum_id = forum.id
+            while forum_id is not None and forum_id not in ancestry:
+                ancestry.append(forum_id)
+                forum_id = parents.get(forum_id)
+            if forum_id is not None:
+                # the last forum reached leads back round the loop, so is cut off from its parent
+                parents[ancestry[-1]] = None
+                Forum.objects.filter(id=ancestry[-1]).update(parent=None)
+            forum.path = ''.join('{}/'.format(forum_id) for forum_id in reversed(ancestry))
+        Forum.objects.bulk_update(forums, ['path'])
+        forget_tree()
+
+    @staticmethod
+    def rebuild_counters(ids=None):
+        """
+        Counts the threads and responses of forums (all of them by default) from scratch,
+        Thread.rebuild_counters having been run on their threads first.
+        """
+        forums = Forum.objects.all() if ids is None else Forum.objects.filter(id__in=ids)
+        threads = Thread.objects.filter(forum=OuterRef('pk')).order_by()
+        totals = threads.values('forum').annotate(
+            threads=Count('id'), responses=Sum('response_count'), last=Max('last_activity'))
+        forums.update(
+            thread_count=Coalesce(Subquery(totals.values('threads')), 0),
+            response_count=Coalesce(Subquery(totals.values('responses')), 0),
+            latest_thread=Subquery(threads.order_by('-pub_date', '-id').values('id')[:1]),
+            last_activity=Subquery(totals.values('last')))
+        Forum.rebuild_recursive_counts()
+
+    @staticmethod
+    def rebuild_recursive_counts():
+        """Adds up thread_count_r for the whole tree, which changes shape so rarely that it's simplest to redo"""
+        forums = {forum.id: forum for forum in Forum.objects.only('id', 'path', 'thread_count', 'thread_count_r')}
+        totals = dict.fromkeys(forums, 0)
+        for forum in forums.values():
+            for forum_id in forum.get_path_ids():
+                if forum_id in totals:
+                    totals[forum_id] += forum.thread_count
+        changed = [forum for forum in forums.values() if forum.thread_count_r != totals[forum.id]]
+        for forum in changed:
+            forum.thread_count_r = totals[forum.id]
+        Forum.objects.bulk_update(changed, ['thread_count_r'])
 
     def get_absolute_url(self):
         return reverse("forum:subforum", args=(self.pk,))
 
 
+class ForumTreeVersion(models.Model):
+    """A single row, moved on whenever a forum changes so that every process knows to read the tree again, see tree"""
+    version = models.IntegerField(default=0)
+
+    @staticmethod
+    def current():
+        return ForumTreeVersion.objects.filter(id=1).values_list('version', flat=True).first() or 0
+
+    @staticmethod
+    def bump():
+        if not ForumTreeVersion.objects.filter(id=1).update(version=F('version') + 1):
+            ForumTreeVersion.objects.get_or_create(id=1, defaults={'version': 1})
+
+
 # return self.thread_set.order_by('pub_date').reverse()[:1][::-1]
 
-class Thread(models.Model):
+class Thread(Denormalised):
     # cascade because we need to be able to delete forums maybe?
     # in which case forumless threads will either die,
     # or need to be moved -before- the forum is deleted
@@ -100,6 +214,8 @@ class Thread(models.Model):
 
     title = models.CharField(max_length=128)
     body = models.TextField(max_length=body_size)
+    # body as parse_md renders it, refreshed on save
+    body_html = models.TextField(blank=True, editable=False)
     pub_date = models.DateTimeField('date posted')
 
     # pinned/stickied/whatever threads will show up before all others in their forums
@@ -115,16 +231,51 @@ class Thread(models.Model):
     subscribed = models.ManyToManyField(
         Member, related_name="thread_notification_subscriptions")
 
+    # Kept up to date as responses are made and deleted, see the receivers below
+    response_count = models.IntegerField(default=0, editable=False)
+    last_response = models.ForeignKey('Response', on_delete=models.SET_NULL, blank=True, null=True,
+                                      editable=False, related_name='+')
+    last_activity = models.DateTimeField(blank=True, null=True, editable=False)
+    denormalised = ('response_count', 'last_response', 'last_activity')
+
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        thread = super().from_db(db, field_names, values)
+        # remembered to notice threads being moved
+        thread._loaded_forum_id = thread.__dict__.get('forum_id')
+        return thread
+
     def get_author(self):
         return Member.objects.get(id=self.author.id).equiv_user.username
 
     get_author.short_description = 'Author'
 
     def get_response_count(self):
-        return Response.objects.filter(thread=self.id).count()
+        return self.response_count
+
+    def get_body_html(self):
+        return mark_safe(self.body_html or render(self.body))
+
+    @staticmethod
+    def rebuild_counters(ids=None):
+        """Counts the responses of threads (all of them by default) from scratch"""
+        threads = Thread.objects.all() if ids is None else Thread.objects.filter(id__in=ids)
+        threads.update(**Thread._counters())
+
+    @staticmethod
+    def _counters(count=None):
+        """Update expressions for a thread's response count (counted unless given) and last response"""
+        responses = Response.objects.filter(thread=OuterRef('pk')).order_by('-pub_date', '-id')
+        if count is None:
+            count = Coalesce(Subquery(responses.order_by().values('thread').annotate(n=Count('id')).values('n')), 0)
+        return {
+            'response_count': count,
+            'last_response': Subquery(responses.values('id')[:1]),
+            'last_activity': Coalesce(Subquery(responses.values('pub_date')[:1]), F('pub_date')),
+        }
 
     def get_all_authors(self):
         authors = [x.author for x in self.response_set.all()]
@@ -142,6 +293,8 @@ class Response(models.Model):
     # when a thread is deleted its responses are deleted
     thread = models.ForeignKey(Thread, on_delete=models.CASCADE)
     body = models.TextField(max_length=body_size)
+    # body as parse_md renders it, refreshed on save
+    body_html = models.TextField(blank=True, editable=False)
 
     pub_date = models.DateTimeField('date posted', auto_now_add=True)
     author = models.ForeignKey(Member, on_delete=models.CASCADE)
@@ -155,5 +308,182 @@ class Response(models.Model):
 
     get_author.short_description = 'Author'
 
+    def get_body_html(self):
+        return mark_safe(self.body_html or render(self.body))
+
+    # leads to the page of the thread starting with this response
     def get_absolute_url(self):
-        return reverse("forum:viewthread", args=(self.thread_id,)) + "#response-" + str(self.pk)
+        return "{}?at={}#response-{}".format(reverse("forum:viewthread", args=(self.thread_id,)), self.pk, self.pk)
+
+    class Meta:
+        indexes = [models.Index(fields=['thread', 'pub_date', 'id'])]
+
+
+# What members have read.
+# Marking a forum read records when, and forgets the member's markers for its threads, so there's a row per forum
+# marked and per thread read since, rather than one per member per thread.
+# A thread is unread if it has a response after its marker, or with no marker if it's had activity since its forum
+# was marked, or if the forum never has been, since the member first looked at a forum listing.
+
+class ThreadRead(models.Model):
+    member = models.ForeignKey(Member, on_delete=models.CASCADE)
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE)
+    # id of the latest response read, 0 if only the thread itself has been.
+    # Not a key, as responses being deleted shouldn't lose the marker
+    response_id = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('member', 'thread')]
+
+    @staticmethod
+    def mark(member, thread, response_id=0):
+        """Notes that member has read thread up to response_id, never moving a marker backwards"""
+        if not ThreadRead.objects.filter(member=member, thread=thread, response_id__lt=response_id).update(
+                response_id=response_id):
+            ThreadRead.objects.get_or_create(member=member, thread=thread, defaults={'response_id': response_id})
+
+    @staticmethod
+    def annotate_unread(threads, member):
+        """
+        Annotates threads with is_unread for member, in the same query that lists them,
+        along with read_response, the id of the last response they read (None without a marker).
+        """
+        markers = ThreadRead.objects.filter(member=member, thread=OuterRef('pk'))
+        watermarks = ForumRead.objects.filter(member=member, forum=OuterRef('forum'))
+        first_visit = ForumRead.objects.filter(member=member, forum=None)
+        return threads.annotate(
+            read_response=Subquery(markers.values('response_id')[:1]),
+            forum_read_at=Coalesce(Subquery(watermarks.values('read_at')[:1]),
+                                   Subquery(first_visit.values('read_at')[:1])),
+        ).annotate(is_unread=Case(
+            When(read_response__isnull=False, then=Case(
+                When(last_response__gt=F('read_response'), then=Value(True)), default=Value(False),
+                output_field=BooleanField())),
+            When(forum_read_at__isnull=False, last_activity__lte=F('forum_read_at'), then=Value(False)),
+            default=Value(True),
+            output_field=BooleanField()))
+
+
+class ForumRead(models.Model):
+    member = models.ForeignKey(Member, on_delete=models.CASCADE)
+    # None for the member's first visit, which stands in for forums they've never marked
+    forum = models.ForeignKey(Forum, on_delete=models.CASCADE, blank=True, null=True)
+    # every thread in the forum with no activity since is read
+    read_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = [('member', 'forum')]
+        constraints = [
+            # unique_together doesn't stop repeated NULLs, so first visits need their own constraint
+            models.UniqueConstraint(fields=['member'], condition=Q(forum=None), name='forum_forumread_first_visit'),
+        ]
+
+    @staticmethod
+    def mark(member, forum):
+        ForumRead.objects.update_or_create(member=member, forum=forum, defaults={'read_at': timezone.now()})
+        ThreadRead.objects.filter(member=member, thread__forum=forum).delete()
+
+    @staticmethod
+    def first_visit(member):
+        """Notes when member first looked at a forum listing, so that everything older than that starts off read"""
+        ForumRead.objects.get_or_create(member=member, forum=None, defaults={'read_at': timezone.now()})
+
+
+# Counters are adjusted in place as posts are made, and recounted for just the affected rows when they're deleted.
+# Posts are made with the current time, so a new post is always the latest.
+
+@receiver(pre_save, sender=Thread)
+def thread_saving(sender, instance, **kwargs):
+    if instance.last_activity is None:
+        instance.last_activity = instance.pub_date
+    instance.body_html = render(instance.body)
+
+
+@receiver(pre_save, sender=Response)
+def response_saving(sender, instance, **kwargs):
+    instance.body_html = render(instance.body)
+
+
+@receiver(post_save, sender=Thread)
+def thread_saved(sender, instance, created, **kwargs):
+    if created:
+        Forum.objects.filter(id=instance.forum_id).update(
+            thread_count=F('thread_count') + 1, latest_thread=instance, last_activity=instance.last_activity)
+        # from the database, as this process's tree may not have caught up with a forum being moved yet
+        ancestry = Forum.objects.only('path').get(id=instance.forum_id).get_path_ids()
+        Forum.objects.filter(id__in=ancestry).update(
+            thread_count_r=F('thread_count_r') + 1)
+    elif getattr(instance, '_loaded_forum_id', instance.forum_id) != instance.forum_id:
+        Forum.rebuild_counters([instance._loaded_forum_id, instance.forum_id])
+    instance._loaded_forum_id = instance.forum_id
+
+
+@receiver(post_delete, sender=Thread)
+def thread_deleted(sender, instance, **kwargs):
+    Forum.rebuild_counters([instance.forum_id])
+
+
+@receiver(post_save, sender=Response)
+def response_saved(sender, instance, created, **kwargs):
+    if created:
+        Thread.objects.filter(id=instance.thread_id).update(
+            response_count=F('response_count') + 1, last_response=instance, last_activity=instance.pub_date)
+        Forum.objects.filter(thread=instance.thread_id).update(
+            response_count=F('response_count') + 1, last_activity=instance.pub_date)
+
+
+@receiver(post_delete, sender=Response)
+def response_deleted(sender, instance, **kwargs):
+    Thread.objects.filter(id=instance.thread_id).update(**Thread._counters(count=F('response_count') - 1))
+    latest = Thread.objects.filter(forum=OuterRef('pk')).order_by().values('forum').annotate(last=Max('last_activity'))
+    Forum.objects.filter(id__in=Thread.objects.filter(id=instance.thread_id).values('forum_id')).update(
+        response_count=F('response_count') - 1, last_activity=Subquery(latest.values('last')))
+
+
+@receiver(post_save, sender=Forum)
+def forum_saved(sender, instance, **kwargs):
+    instance.update_path()
+    forget_tree()
+    Forum.rebuild_recursive_counts()
+
+
+@receiver(post_delete, sender=Forum)
+def forum_deleted(sender, instance, **kwargs):
+    forget_tree()
+    Forum.rebuild_recursive_counts()
+
+
+# Keeping the search index up to date
+
+@receiver(post_migrate)
+def create_search_index(sender, **kwargs):
+    if sender.label == 'forum':
+        search.create_index()
+
+
+@receiver(post_save, sender=Thread)
+def thread_indexed(sender, instance, **kwargs):
+    search.index_thread(instance)
+
+
+@receiver(post_delete, sender=Thread)
+def thread_unindexed(sender, instance, **kwargs):
+    search.remove_thread(instance.id)
+
+
+@receiver(post_save, sender=Response)
+def response_indexed(sender, instance, **kwargs):
+    search.index_response(instance)
+
+
+@receiver(post_delete, sender=Response)
+def response_unindexed(sender, instance, **kwargs):
+    search.remove_response(instance.id)
+
+
+@receiver(post_save, sender=Thread)
+@receiver(post_delete, sender=Thread)
+@receiver(post_save, sender=Response)
+@receiver(post_delete, sender=Response)
+def recent_changed(sender, **kwargs):
+    forget_recent()
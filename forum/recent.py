@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.cache import caches
+
+"""
+Recent forum activity
+
+The latest threads and responses, as listed on every page that shows recent activity.
+They're read together and cached until a thread or response is posted, edited or deleted,
+when forget_recent() is called by the receivers in models.
+With settings.RECENT_POSTS_CACHE naming a cache shared between processes, forgetting reaches all of them.
+Otherwise they're kept in the default cache, and as that's per process unless CACHES says otherwise,
+other processes may show posts up to LOCAL_TIMEOUT out of date.
+"""
+
+KEY = "forum:recent"
+# Posts of each kind listed
+COUNT = 5
+# Seconds, in a shared cache that every process hears about new posts through
+SHARED_TIMEOUT = 10 * 60
+# Seconds, kept short as other processes may not hear about new posts
+LOCAL_TIMEOUT = 30
+
+
+def get_cache():
+    shared = getattr(settings, 'RECENT_POSTS_CACHE', None)
+    return (caches[shared], SHARED_TIMEOUT) if shared else (caches['default'], LOCAL_TIMEOUT)
+
+
+def get_recent():
+    """A dict of the latest 'threads' and 'responses', newest first"""
+    from .models import Thread, Response
+    cache, timeout = get_cache()
+    recent = cache.get(KEY)
+    if recent is None:
+        recent = {
+            'threads': list(Thread.objects.select_related('author__equiv_user').order_by('-pub_date')[:COUNT]),
+            'responses': list(Response.objects.select_related('author__equiv_user', 'thread')
+                              .order_by('-pub_date')[:COUNT]),
+        }
+        cache.set(KEY, recent, timeout)
+    return recent
+
+
+def forget_recent():
+    cache, _ = get_cache()
+    cache.delete(KEY)
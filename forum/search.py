@@ -0,0 +1,188 @@
+import re
+
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+"""
+Forum full text search
+
+Threads and responses are indexed in an SQLite FTS5 table, ranked by bm25 with titles counting for more than bodies.
+A thread is stored at rowid 2 * id and a response at 2 * id + 1, so either can be replaced or removed by rowid.
+Ranking has to score every match, so for very common words only the newest matches are ranked,
+which keeps any search to a few milliseconds however long the forum's history gets.
+Thread and response ids grow at different rates, so the newest are found separately for each,
+as the highest even and the highest odd rowids.
+The index is created after migrations and kept up to date by the receivers in models, and can be rebuilt
+with the forum_search command. Other databases have no index, and search is simply unavailable.
+"""
+
+TABLE = "forum_search"
+# bm25 weights of the title and body columns
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+# markers put around matches by snippet(), replaced with tags once the snippet is escaped
+MATCH_START, MATCH_END = "\x02", "\x03"
+SNIPPET_TOKENS = 24
+# matching threads and matching responses ranked at most, newest first
+MAX_RESULTS = 5000
+BATCH_SIZE = 1000
+
+_term = re.compile(r"\w+\*?")
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def create_index():
+    if available():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5("
+                "title, body, thread_id UNINDEXED, tokenize='porter unicode61', prefix='2 3')".format(TABLE))
+
+
+def _thread_row(thread_id, title, body):
+    return 2 * thread_id, title, body, thread_id
+
+
+def _response_row(response_id, thread_id, body):
+    return 2 * response_id + 1, "", body, thread_id
+
+
+def _replace(rows):
+    with connection.cursor() as cursor:
+        cursor.executemany("INSERT OR REPLACE INTO {} (rowid, title, body, thread_id) VALUES (%s, %s, %s, %s)"
+                           .format(TABLE), rows)
+
+
+def _remove(rowid):
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {} WHERE rowid = %s".format(TABLE), [rowid])
+
+
+def index_thread(thread):
+    if available():
+        _replace([_thread_row(thread.id, thread.title, thread.body)])
+
+
+def index_response(response):
+    if available():
+        _replace([_response_row(response.id, response.thread_id, response.body)])
+
+
+def remove_thread(thread_id):
+    if available():
+        _remove(2 * thread_id)
+
+
+def remove_response(response_id):
+    if available():
+        _remove(2 * response_id + 1)
+
+
+def rebuild_index():
+    """Indexes every thread and response from scratch, returning how many posts were indexed"""
+    from .models import Thread, Response
+    if not available():
+        return 0
+    create_index()
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {}".format(TABLE))
+    count = 0
+    for rows in (
+            (_thread_row(*row) for row in Thread.objects.values_list('id', 'title', 'body').iterator()),
+            (_response_row(*row) for row in Response.objects.values_list('id', 'thread_id', 'body').iterator())):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                _replace(batch)
+                count += len(batch)
+                batch = []
+        _replace(batch)
+        count += len(batch)
+    return count
+
+
+def parse_query(text):
+    """
+    Makes an FTS5 query matching posts with every word in text, so that nothing typed can be a syntax error.
+    A word ending in * matches anything starting with it.
+    """
+    terms = []
+    for term in _term.findall(text):
+        prefix = term.endswith("*")
+        terms.append('"{}"{}'.format(term.rstrip("*"), "*" if prefix else ""))
+    return " ".join(terms)
+
+
+def _highlight(snippet):
+    return mark_safe(escape(snippet).replace(MATCH_START, "<mark>").replace(MATCH_END, "</mark>"))
+
+
+class SearchResults:
+    """
+    The posts matching a query, best first, for handing to a Paginator.
+    Each result is a dict of the thread, the response (None if the thread itself matched) and a highlighted snippet.
+    """
+
+    def __init__(self, text):
+        self.query = parse_query(text) if available() else ""
+        self._window = None
+
+    def _newest(self):
+        """The number of matches that will be ranked, and the lowest thread and response rowids among them"""
+        if self._window is None:
+            self._window = 0, 0, 0
+            if self.query:
+                with connection.cursor() as cursor:
+                    windows = []
+                    for kind in (0, 1):
+                        cursor.execute("SELECT count(*), min(rowid) FROM (SELECT rowid FROM {0} WHERE {0} MATCH %s "
+                                       "AND (rowid & 1) = %s ORDER BY rowid DESC LIMIT %s)".format(TABLE),
+                                       [self.query, kind, MAX_RESULTS])
+                        windows.append(cursor.fetchone())
+                (threads, lowest_thread), (responses, lowest_response) = windows
+                self._window = threads + responses, lowest_thread or 0, lowest_response or 0
+        return self._window
+
+    def count(self):
+        return self._newest()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError("Search results can only be sliced")
+        start, stop = item.start or 0, item.stop
+        count, lowest_thread, lowest_response = self._newest()
+        stop = count if stop is None else min(stop, count)
+        if stop <= start:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid, thread_id, snippet({0}, 1, %s, %s, '…', %s) FROM {0} WHERE {0} MATCH %s "
+                "AND rowid >= CASE rowid & 1 WHEN 0 THEN %s ELSE %s END "
+                "ORDER BY bm25({0}, %s, %s) LIMIT %s OFFSET %s".format(TABLE),
+                [MATCH_START, MATCH_END, SNIPPET_TOKENS, self.query, lowest_thread, lowest_response,
+                 TITLE_WEIGHT, BODY_WEIGHT, stop - start, start])
+            rows = cursor.fetchall()
+        return self._results(rows)
+
+    @staticmethod
+    def _results(rows):
+        from .models import Thread, Response
+        threads = Thread.objects.select_related('forum', 'author__equiv_user').in_bulk(
+            {thread_id for _, thread_id, _ in rows})
+        responses = Response.objects.select_related('author__equiv_user').in_bulk(
+            {rowid // 2 for rowid, _, _ in rows if rowid % 2})
+        results = []
+        for rowid, thread_id, snippet in rows:
+            response = responses.get(rowid // 2) if rowid % 2 else None
+            # skipping anything deleted without the index hearing about it
+            if thread_id in threads and (response is not None or not rowid % 2):
+                results.append({'thread': threads[thread_id], 'response': response, 'snippet': _highlight(snippet)})
+        return results
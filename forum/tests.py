@@ -1,3 +1,457 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from notifications.models import Notification, NotificationSubscriptions, NotifType, SubType
+from tgrsite.context_processors import latestposts
+from users.models import Member
+from .models import Forum, ForumTreeVersion, Thread, Response, ThreadRead, ForumRead
+from . import search
+from .recent import KEY as RECENT_KEY
+from . import tree
+from .tree import get_tree
+
+
+def post_thread(forum, author, title="Thread", when=None):
+    return Thread.objects.create(forum=forum, author=author, title=title, body="Body",
+                                 pub_date=when or timezone.now())
+
+
+def counters(model):
+    fields = [field.name for field in model._meta.fields if not field.editable and field.name != 'id']
+    return list(model.objects.order_by('id').values_list('id', *fields))
+
+
+class Counters(TestCase):
+    def setUp(self):
+        self.member = Member.objects.create(equiv_user=User.objects.create(username='poster'))
+        self.root = Forum.objects.create(title="Root")
+        self.child = Forum.objects.create(title="Child", parent=self.root)
+        self.grandchild = Forum.objects.create(title="Grandchild", parent=self.child)
+
+    def refresh(self):
+        for forum in (self.root, self.child, self.grandchild):
+            forum.refresh_from_db()
+
+    def test_thread_counts(self):
+        post_thread(self.grandchild, self.member)
+        post_thread(self.child, self.member)
+        latest = post_thread(self.child, self.member)
+        self.refresh()
+        self.assertEqual([f.thread_count for f in (self.root, self.child, self.grandchild)], [0, 2, 1])
+        self.assertEqual([f.thread_count_r for f in (self.root, self.child, self.grandchild)], [3, 3, 1])
+        self.assertEqual(self.child.get_latest_post(), latest)
+
+        latest.delete()
+        self.refresh()
+        self.assertEqual([f.thread_count_r for f in (self.root, self.child, self.grandchild)], [2, 2, 1])
+        self.assertNotEqual(self.child.latest_thread_id, latest.id)
+        self.assertIsNotNone(self.child.latest_thread_id)
+
+    def test_rendered_on_save(self):
+        thread = post_thread(self.child, self.member)
+        response = Response.objects.create(thread=thread, author=self.member, body="*Reply*")
+        self.assertEqual(Response.objects.get(id=response.id).body_html, "<p><em>Reply</em></p>")
+        response.body = "**Edited**"
+        response.save()
+        self.assertEqual(Response.objects.get(id=response.id).get_body_html(), "<p><strong>Edited</strong></p>")
+
+    def test_response_counts(self):
+        thread = post_thread(self.child, self.member, when=timezone.now() - timedelta(days=1))
+        first = Response.objects.create(thread=thread, author=self.member, body="First")
+        second = Response.objects.create(thread=thread, author=self.member, body="Second")
+        thread.refresh_from_db()
+        self.assertEqual((thread.get_response_count(), thread.last_response, thread.last_activity),
+                         (2, second, second.pub_date))
+
+        second.delete()
+        thread.refresh_from_db()
+        self.child.refresh_from_db()
+        self.assertEqual((thread.response_count, thread.last_response, thread.last_activity),
+                         (1, first, first.pub_date))
+        self.assertEqual((self.child.response_count, self.child.last_activity), (1, first.pub_date))
+
+        first.delete()
+        thread.refresh_from_db()
+        self.assertEqual((thread.response_count, thread.last_response, thread.last_activity),
+                         (0, None, thread.pub_date))
+
+    def test_moves(self):
+        thread = post_thread(self.grandchild, self.member)
+        Response.objects.create(thread=thread, author=self.member, body="Reply")
+        thread = Thread.objects.get(id=thread.id)
+        thread.forum = self.root
+        thread.save()
+        self.refresh()
+        self.assertEqual([(f.thread_count, f.response_count) for f in (self.root, self.grandchild)], [(1, 1), (0, 0)])
+        self.assertEqual([f.thread_count_r for f in (self.root, self.child, self.grandchild)], [1, 0, 0])
+
+        # moving the grandchild to the top level takes its threads with it
+        post_thread(self.grandchild, self.member)
+        self.grandchild.parent = None
+        self.grandchild.save()
+        self.refresh()
+        self.assertEqual([f.thread_count_r for f in (self.root, self.child, self.grandchild)], [1, 0, 1])
+
+    def test_rebuild(self):
+        for forum in (self.root, self.child, self.grandchild):
+            for i in range(3):
+                thread = post_thread(forum, self.member)
+                for _ in range(i):
+                    Response.objects.create(thread=thread, author=self.member, body="Reply")
+        Response.objects.first().delete()
+        Thread.objects.filter(forum=self.child).first().delete()
+        maintained = (counters(Forum), counters(Thread))
+
+        Forum.objects.update(thread_count=0, thread_count_r=0, response_count=0, latest_thread=None)
+        Thread.objects.update(response_count=0, last_response=None)
+        call_command('forum_counters', stdout=StringIO())
+        self.assertEqual((counters(Forum), counters(Thread)), maintained)
+
+    def test_listing_queries(self):
+        def forum_queries(context):
+            # member badges are looked up per author, which is nothing to do with the forum
+            return [query for query in context.captured_queries if '"forum_' in query['sql']]
+
+        url = reverse('forum:subforum', args=(self.root.id,))
+        post_thread(self.root, self.member)
+        self.client.get(url, secure=True)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url, secure=True)
+        for i in range(5):
+            post_thread(self.root, self.member)
+            post_thread(Forum.objects.create(title="Another child {}".format(i), parent=self.root), self.member)
+        # reading the changed tree again
+        self.client.get(url, secure=True)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url, secure=True)
+        self.assertEqual(len(forum_queries(many)), len(forum_queries(few)))
+
+
+class Hierarchy(TestCase):
+    def setUp(self):
+        self.root = Forum.objects.create(title="Root")
+        self.child = Forum.objects.create(title="Child", parent=self.root)
+        self.grandchild = Forum.objects.create(title="Grandchild", parent=self.child)
+        self.other = Forum.objects.create(title="Other")
+
+    def paths(self):
+        return dict(Forum.objects.values_list('title', 'path'))
+
+    def test_paths(self):
+        r, c, g, o = (f.id for f in (self.root, self.child, self.grandchild, self.other))
+        self.assertEqual(self.paths(), {"Root": "{}/".format(r), "Child": "{}/{}/".format(r, c),
+                                        "Grandchild": "{}/{}/{}/".format(r, c, g), "Other": "{}/".format(o)})
+        self.assertEqual(list(self.root.get_descendants().order_by('id')), [self.child, self.grandchild])
+
+        self.child.parent = self.other
+        self.child.save()
+        self.assertEqual(self.paths()["Grandchild"], "{}/{}/{}/".format(o, c, g))
+        self.assertEqual(list(self.other.get_descendants().order_by('id')), [self.child, self.grandchild])
+
+        Forum.objects.update(path='')
+        Forum.rebuild_paths()
+        self.assertEqual(self.paths()["Grandchild"], "{}/{}/{}/".format(o, c, g))
+
+    def test_loops(self):
+        self.root.parent = self.grandchild
+        with self.assertRaises(ValidationError):
+            self.root.full_clean()
+
+        # made by hand, bypassing validation
+        Forum.objects.filter(id=self.root.id).update(parent=self.grandchild)
+        Forum.rebuild_paths()
+        self.assertEqual(Forum.objects.filter(parent=None).count(), 2)
+        for forum in Forum.objects.all():
+            parent_path = forum.parent.path if forum.parent else ""
+            self.assertEqual(forum.path, "{}{}/".format(parent_path, forum.id))
+
+    def test_parents_from_cache(self):
+        get_tree()
+        grandchild = Forum.objects.get(id=self.grandchild.id)
+        with self.assertNumQueries(0):
+            self.assertEqual([f.title for f in grandchild.get_parents()], ["Root", "Child"])
+            self.assertEqual(grandchild.get_parent_tree(), "Root / Child")
+            self.assertEqual(self.root.get_subforums_str(), ["Child"])
+            self.assertEqual(Forum.get_ancestry(self.grandchild.id),
+                             [self.root.id, self.child.id, self.grandchild.id])
+
+        self.grandchild.title = "Renamed"
+        self.grandchild.save()
+        self.assertEqual(self.child.get_subforums_str(), ["Renamed"])
+
+    def test_changes_in_other_processes(self):
+        get_tree()
+        # as another process would rename it, leaving this one's tree alone
+        Forum.objects.filter(id=self.child.id).update(title="Renamed")
+        ForumTreeVersion.bump()
+        self.assertEqual(self.root.get_subforums_str(), ["Child"])
+        with mock.patch.object(tree, 'CHECK_INTERVAL', 0):
+            self.assertEqual(self.root.get_subforums_str(), ["Renamed"])
+
+    def test_counters_ignore_stale_tree(self):
+        stale = get_tree()
+        self.child.parent = self.other
+        self.child.save()
+        with mock.patch.object(tree, '_tree', stale):
+            post_thread(self.grandchild, Member.objects.create(equiv_user=User.objects.create(username='poster')))
+        counts = dict(Forum.objects.values_list('title', 'thread_count_r'))
+        self.assertEqual(counts, {"Root": 0, "Child": 1, "Grandchild": 1, "Other": 1})
+
+
+class ResponsePages(TestCase):
+    def setUp(self):
+        self.member = Member.objects.create(equiv_user=User.objects.create(username='poster'))
+        self.thread = post_thread(Forum.objects.create(title="Forum"), self.member)
+        now = timezone.now()
+        # some share a time, to be ordered by id
+        self.responses = [Response.objects.create(thread=self.thread, author=self.member, body=str(i))
+                          for i in range(45)]
+        for i, response in enumerate(self.responses):
+            Response.objects.filter(id=response.id).update(pub_date=now + timedelta(seconds=i // 2))
+        self.url = reverse('forum:viewthread', args=(self.thread.id,))
+
+    def page(self, **params):
+        context = self.client.get(self.url, params, secure=True).context
+        return ([int(r.body) for r in context['responses']], context['previous_response'],
+                context['next_response'])
+
+    def test_pages(self):
+        ids = [r.id for r in self.responses]
+        self.assertEqual(self.page(), (list(range(20)), None, ids[19]))
+        self.assertEqual(self.page(after=ids[19]), (list(range(20, 40)), ids[20], ids[39]))
+        self.assertEqual(self.page(after=ids[39]), (list(range(40, 45)), ids[40], None))
+        self.assertEqual(self.page(before=ids[40]), (list(range(20, 40)), ids[20], ids[39]))
+        self.assertEqual(self.page(before=ids[5]), (list(range(5)), None, ids[4]))
+        self.assertEqual(self.page(at=ids[7]), (list(range(7, 27)), ids[7], ids[26]))
+
+    def test_links(self):
+        response = self.responses[30]
+        page = self.client.get(response.get_absolute_url(), secure=True)
+        self.assertEqual(page.context['responses'][0], response)
+        self.assertContains(page, 'id="response-{}"'.format(response.id))
+
+        deleted = response.id
+        response.delete()
+        self.assertEqual(self.page(at=deleted)[0], list(range(20)))
+
+    def test_fragments(self):
+        ids = [r.id for r in self.responses]
+        url = reverse('forum:thread_responses', args=(self.thread.id,))
+        data = self.client.get(url, {'after': ids[39]}, secure=True).json()
+        self.assertIsNone(data['next'])
+        self.assertEqual(data['html'].count('class="anchor"'), 5)
+        self.assertIn('id="response-{}"'.format(ids[44]), data['html'])
+        self.assertEqual(self.client.get(url, {'after': ids[0]}, secure=True).json()['next'], ids[20])
+
+
+class Search(TestCase):
+    def setUp(self):
+        self.member = Member.objects.create(equiv_user=User.objects.create(username='poster'))
+        forum = Forum.objects.create(title="Forum")
+        self.dragons = post_thread(forum, self.member, title="Dragons")
+        self.other = post_thread(forum, self.member, title="Board games")
+        self.reply = Response.objects.create(thread=self.other, author=self.member,
+                                             body="We should play a game <b>with dragons</b> in it")
+
+    def search(self, query):
+        return [(result['thread'], result['response']) for result in search.SearchResults(query)[0:20]]
+
+    def test_ranking(self):
+        # titles count for more than bodies
+        self.assertEqual(self.search("dragon"), [(self.dragons, None), (self.other, self.reply)])
+        self.assertEqual(self.search("dragons game"), [(self.other, self.reply)])
+        self.assertEqual(self.search("gam*"), [(self.other, None), (self.other, self.reply)])
+        # nothing typed is a syntax error
+        self.assertEqual(self.search('"AND (NOT'), [])
+        self.assertEqual(search.SearchResults("dragons").count(), 2)
+
+    def test_newest_of_each_kind(self):
+        # far more responses than threads, so response rowids run well ahead of thread ones
+        newer = [Response.objects.create(thread=self.other, author=self.member, body="More dragons")
+                 for _ in range(3)]
+        with mock.patch.object(search, 'MAX_RESULTS', 1):
+            self.assertCountEqual(self.search("dragons"), [(self.dragons, None), (self.other, newer[-1])])
+            self.assertEqual(search.SearchResults("dragons").count(), 2)
+
+    def test_kept_up_to_date(self):
+        self.reply.body = "Never mind"
+        self.reply.save()
+        self.assertEqual(self.search("dragons"), [(self.dragons, None)])
+        self.dragons.title = "Wyverns"
+        self.dragons.save()
+        self.assertEqual(self.search("dragons"), [])
+        self.other.delete()
+        self.assertEqual(self.search("never"), [])
+
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {}".format(search.TABLE))
+        call_command('forum_search', stdout=StringIO())
+        self.assertEqual(self.search("wyverns"), [(self.dragons, None)])
+
+    def test_view(self):
+        page = self.client.get(reverse('forum:search'), {'q': 'dragons'}, secure=True)
+        self.assertEqual(page.context['paginator'].count, 2)
+        # matches are highlighted and everything else escaped
+        self.assertContains(page, "&lt;b&gt;with <mark>dragons</mark>&lt;/b&gt;")
+
+
+class ReplyNotifications(TestCase):
+    def setUp(self):
+        self.poster = Member.objects.create(equiv_user=User.objects.create(username='poster'))
+        self.forum = Forum.objects.create(title="Forum")
+        self.client.force_login(self.poster.equiv_user)
+
+    def subscribed_thread(self, subscribers):
+        thread = post_thread(self.forum, self.poster)
+        thread.subscribed.add(*subscribers)
+        return thread
+
+    def reply(self, thread):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('forum:viewthread', args=(thread.id,)), {'body': "Reply"}, secure=True)
+        return len(queries)
+
+    def test_notified(self):
+        members = [Member.objects.create(equiv_user=User.objects.create(username='member{}'.format(i)))
+                   for i in range(3)]
+        NotificationSubscriptions.objects.create(member=members[0], forum_reply=SubType.NONE)
+        thread = self.subscribed_thread(members + [self.poster])
+        self.reply(thread)
+        notified = Notification.objects.filter(notif_type=NotifType.FORUM_REPLY, merge_key=thread.id)
+        self.assertCountEqual(notified.values_list('member', flat=True), [members[1].id, members[2].id])
+        self.assertEqual(NotificationSubscriptions.objects.filter(member__in=members).count(), 3)
+        self.assertIn(self.poster, thread.subscribed.all())
+
+    def test_constant_queries(self):
+        self.reply(self.subscribed_thread([]))
+        counts = []
+        for size in (1, 20):
+            members = [Member.objects.create(equiv_user=User.objects.create(username='{}-{}'.format(size, i)))
+                       for i in range(size)]
+            counts.append(self.reply(self.subscribed_thread(members)))
+        self.assertEqual(counts[0], counts[1])
+
+
+class RecentPosts(TestCase):
+    def setUp(self):
+        cache.delete(RECENT_KEY)
+        self.member = Member.objects.create(equiv_user=User.objects.create(username='poster'))
+        self.forum = Forum.objects.create(title="Forum")
+        self.threads = [post_thread(self.forum, self.member, title=str(i)) for i in range(6)]
+
+    def test_lazy(self):
+        with self.assertNumQueries(0):
+            context = latestposts(None)
+        with self.assertNumQueries(2):
+            self.assertEqual([thread.title for thread in context['latestthreads']], ['5', '4', '3', '2', '1'])
+        with self.assertNumQueries(0):
+            context = latestposts(None)
+            self.assertEqual(list(context['latestresponses']), [])
+            self.assertEqual(len(context['latestthreads']), 5)
+
+    def test_forgotten(self):
+        list(latestposts(None)['latestthreads'])
+        response = Response.objects.create(thread=self.threads[0], author=self.member, body="Reply")
+        self.assertEqual(list(latestposts(None)['latestresponses']), [response])
+        self.threads[5].title = "Edited"
+        self.threads[5].save()
+        self.assertEqual(latestposts(None)['latestthreads'][0].title, "Edited")
+        self.threads[5].delete()
+        self.assertEqual(latestposts(None)['latestthreads'][0].title, "4")
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+        'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+    }, RECENT_POSTS_CACHE='shared')
+    def test_shared_cache(self):
+        list(latestposts(None)['latestthreads'])
+        self.assertIsNotNone(caches['shared'].get(RECENT_KEY))
+        self.assertIsNone(caches['default'].get(RECENT_KEY))
+        post_thread(self.forum, self.member, title="New")
+        self.assertIsNone(caches['shared'].get(RECENT_KEY))
+
+
+class ReadMarkers(TestCase):
+    def setUp(self):
+        self.reader = Member.objects.create(equiv_user=User.objects.create(username='reader'))
+        self.poster = Member.objects.create(equiv_user=User.objects.create(username='poster'))
+        self.forum = Forum.objects.create(title="Forum")
+        ForumRead.first_visit(self.reader)
+        self.threads = [post_thread(self.forum, self.poster, title=str(i)) for i in range(3)]
+        self.client.force_login(self.reader.equiv_user)
+
+    def unread(self):
+        threads = ThreadRead.annotate_unread(Thread.objects.order_by('id'), self.reader)
+        return [thread.title for thread in threads if thread.is_unread]
+
+    def reply(self, thread):
+        return Response.objects.create(thread=thread, author=self.poster, body="Reply")
+
+    def test_threads(self):
+        self.assertEqual(self.unread(), ['0', '1', '2'])
+        self.client.get(self.threads[0].get_absolute_url(), secure=True)
+        self.assertEqual(self.unread(), ['1', '2'])
+
+        response = self.reply(self.threads[0])
+        self.assertEqual(self.unread(), ['0', '1', '2'])
+        self.client.get(response.get_absolute_url(), secure=True)
+        self.assertEqual(ThreadRead.objects.get(member=self.reader, thread=self.threads[0]).response_id, response.id)
+        self.assertEqual(self.unread(), ['1', '2'])
+
+        # reading earlier pages leaves the marker where it was
+        ThreadRead.mark(self.reader, self.threads[0])
+        self.assertEqual(self.unread(), ['1', '2'])
+        # as does the last response read being deleted
+        response.delete()
+        self.assertEqual(self.unread(), ['1', '2'])
+
+    def test_forum_read(self):
+        self.client.get(self.threads[0].get_absolute_url(), secure=True)
+        self.client.post(reverse('forum:forum_read', args=(self.forum.id,)), secure=True)
+        self.assertEqual(self.unread(), [])
+        # markers are folded into the forum's
+        self.assertFalse(ThreadRead.objects.filter(member=self.reader).exists())
+
+        self.reply(self.threads[1])
+        self.assertEqual(self.unread(), ['1'])
+        # nobody else's reading counts
+        other = Member.objects.create(equiv_user=User.objects.create(username='other'))
+        ForumRead.mark(other, self.forum)
+        self.assertEqual(self.unread(), ['1'])
+
+    def test_listing(self):
+        ThreadRead.mark(self.reader, self.threads[2])
+        page = self.client.get(reverse('forum:subforum', args=(self.forum.id,)), secure=True)
+        self.assertEqual([thread.is_unread for thread in page.context['threads']], [False, True, True])
+        self.reply(self.threads[2])
+        page = self.client.get(reverse('forum:subforum', args=(self.forum.id,)), secure=True)
+        self.assertContains(page, '{}?after=0"'.format(self.threads[2].get_absolute_url()), count=0)
+        self.assertContains(page, 'New</span>', count=3)
+
+    def test_older_than_first_visit(self):
+        # what was there before someone first looked isn't all new to them
+        newcomer = Member.objects.create(equiv_user=User.objects.create(username='newcomer'))
+        self.client.force_login(newcomer.equiv_user)
+        page = self.client.get(reverse('forum:subforum', args=(self.forum.id,)), secure=True)
+        self.assertEqual([thread.is_unread for thread in page.context['threads']], [False, False, False])
+        self.reply(self.threads[0])
+        page = self.client.get(reverse('forum:subforum', args=(self.forum.id,)), secure=True)
+        self.assertEqual([thread.is_unread for thread in page.context['threads']], [False, False, True])
+        self.assertEqual(ForumRead.objects.filter(member=newcomer).count(), 1)
+
+    def test_one_first_visit(self):
+        ForumRead.first_visit(self.reader)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ForumRead.objects.create(member=self.reader, forum=None, read_at=timezone.now())
+        self.assertEqual(ForumRead.objects.filter(member=self.reader, forum=None).count(), 1)
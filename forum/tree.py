@@ -0,0 +1,76 @@
+import time
+from collections import defaultdict
+
+"""
+Forum hierarchy cache
+
+The whole forum tree is read in one query and kept in memory, so that breadcrumbs and listings of subforums
+don't need a query per level. Forums change very rarely, so any change just throws the tree away.
+Each process keeps its own copy, and knows it's out of date when the ForumTreeVersion in the database moves on,
+which it checks at most every CHECK_INTERVAL seconds. forget_tree() is called whenever a forum is saved or deleted.
+As the tree can be that far behind, anything that changes data (like counters) works from the database instead.
+"""
+
+# Seconds a process trusts its tree for before checking the version again
+CHECK_INTERVAL = 5
+# The fields that describe the tree, counters are left out as they change with every post
+FIELDS = ('id', 'parent_id', 'path', 'sort_index', 'title', 'description')
+
+_tree = None
+_checked_at = None
+
+
+class ForumTree:
+    def __init__(self, forums, version=None):
+        """forums being every forum, in the order they should be listed in"""
+        self.version = version
+        self.forums = {forum.id: forum for forum in forums}
+        self._children = defaultdict(list)
+        for forum in forums:
+            self._children[forum.parent_id].append(forum)
+
+    def get(self, forum_id):
+        return self.forums[forum_id]
+
+    def ancestry(self, forum_id):
+        """Ids of a forum and every forum above it, root first"""
+        forum = self.forums.get(forum_id)
+        return forum.get_path_ids() if forum else []
+
+    def parents(self, forum_id):
+        """The forums above a forum, root first"""
+        return [self.forums[ancestor] for ancestor in self.ancestry(forum_id)[:-1]]
+
+    def children(self, forum_id=None):
+        """The forums directly below a forum, or the top level forums"""
+        return self._children[forum_id]
+
+    def descendants(self, forum_id):
+        """Every forum below a forum, depth first"""
+        found = []
+        for child in self._children[forum_id]:
+            found.append(child)
+            found += self.descendants(child.id)
+        return found
+
+
+def get_tree() -> ForumTree:
+    """The forum tree, read from the database only if it's changed since this process last looked"""
+    global _tree, _checked_at
+    from .models import Forum, ForumTreeVersion
+    now = time.monotonic()
+    if _tree is None or _checked_at is None or now - _checked_at >= CHECK_INTERVAL:
+        # read before the forums, so that a change made in between is noticed next time
+        version = ForumTreeVersion.current()
+        _checked_at = now
+        if _tree is None or _tree.version != version:
+            _tree = ForumTree(list(Forum.objects.only(*FIELDS).order_by('sort_index', 'id')), version)
+    return _tree
+
+
+def forget_tree():
+    """Makes every process read the tree again"""
+    global _tree
+    from .models import ForumTreeVersion
+    _tree = None
+    ForumTreeVersion.bump()
@@ -7,9 +7,12 @@ app_name = "forum"
 urlpatterns = [
     path('', views.RootForum.as_view(), name='forum'),
     path('<int:forum>/', views.ViewSubforum.as_view(), name='subforum'),
+    path('<int:forum>/read/', views.MarkForumRead.as_view(), name='forum_read'),
     path('recent/', views.Recent.as_view(), name='recent'),
+    path('search/', views.Search.as_view(), name='search'),
 
     path('thread/<int:thread>/', views.ViewThread.as_view(), name='viewthread'),
+    path('thread/<int:thread>/responses/', views.ThreadResponses.as_view(), name='thread_responses'),
 
     path('thread/<int:pk>/delete/',
          views.DeleteThread.as_view(), name='thread_delete'),
@@ -5,12 +5,15 @@ from django.utils import timezone
 from django.views.generic import View, ListView, CreateView, UpdateView, DeleteView, TemplateView
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin, AccessMixin
-from django.http import HttpResponseRedirect
+from django.db.models import Q
+from django.http import HttpResponseRedirect, JsonResponse
+from django.template.loader import render_to_string
 
 from notifications.models import NotifType
-from notifications.utils import notify
+from notifications.utils import notify_members
+from . import search
 from .forms import ThreadForm, ResponseForm
-from .models import Thread, Response, Forum
+from .models import Thread, Response, Forum, ThreadRead, ForumRead
 from users.achievements import give_achievement_once
 
 
@@ -20,7 +23,7 @@ class RootForum(ListView):
     context_object_name = "forums"
 
     def get_queryset(self):
-        return Forum.get_parentless_forums().order_by('sort_index')
+        return Forum.get_parentless_forums().select_related('latest_thread').order_by('sort_index')
 
 
 class Recent(TemplateView):
@@ -38,6 +41,23 @@ class Recent(TemplateView):
         return context
 
 
+class Search(ListView):
+    template_name = "forum/search.html"
+    context_object_name = "results"
+    paginate_by = 20
+
+    def get_queryset(self):
+        return search.SearchResults(self.request.GET.get('q', ''))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update({
+            'query': self.request.GET.get('q', ''),
+            'available': search.available(),
+        })
+        return context
+
+
 class ViewSubforum(AccessMixin, SuccessMessageMixin, CreateView):
     model = Thread
     form_class = ThreadForm
@@ -57,11 +77,14 @@ class ViewSubforum(AccessMixin, SuccessMessageMixin, CreateView):
         context = super().get_context_data(**kwargs)
         current_forum = get_object_or_404(Forum, id=self.kwargs['forum'])
         # put pinned/stickied threads first
-        threads = Thread.objects.filter(forum_id=self.kwargs['forum']).extra(
+        threads = Thread.objects.filter(forum_id=self.kwargs['forum']).select_related('author__equiv_user').extra(
             order_by=['-is_pinned', '-pub_date'])
+        if self.request.user.is_authenticated:
+            ForumRead.first_visit(self.request.user.member)
+            threads = ThreadRead.annotate_unread(threads, self.request.user.member)
         context.update({
             'current': current_forum,
-            'forums': current_forum.get_subforums().order_by('sort_index'),
+            'forums': current_forum.get_subforums().select_related('latest_thread').order_by('sort_index'),
             'threads': threads
         })
         return context
@@ -83,7 +106,61 @@ class ViewSubforum(AccessMixin, SuccessMessageMixin, CreateView):
         return response
 
 
-class ViewThread(AccessMixin, SuccessMessageMixin, CreateView):
+class ResponsePageMixin:
+    """
+    Pages through a thread's responses in (pub_date, id) order, seeking from a response rather than counting
+    past every earlier one, so that pages deep into a long thread cost no more than the first.
+    ?after=<id> is the page following a response, ?before=<id> the page ending just before one,
+    and ?at=<id> the page starting with one, which is where links to a response lead.
+    Showing a page to a member marks the thread read up to its last response.
+    """
+    responses_per_page = 20
+
+    def get_response_page(self, thread):
+        responses = Response.objects.filter(thread=thread).select_related('author__equiv_user')
+        direction, cursor = None, None
+        for key in ('at', 'after', 'before'):
+            if self.request.GET.get(key, '').isdigit():
+                # a response that's since been deleted leads to the first page
+                cursor = responses.filter(id=self.request.GET[key]).values_list('pub_date', 'id').first()
+                direction = key if cursor else None
+                break
+        n = self.responses_per_page
+
+        if direction == 'before':
+            page = list(responses.filter(_before(cursor)).order_by('-pub_date', '-id')[:n + 1])
+            has_previous, has_next = len(page) > n, True
+            page = page[:n][::-1]
+        else:
+            if direction is not None:
+                responses = responses.filter(_after(cursor, inclusive=direction == 'at'))
+            page = list(responses.order_by('pub_date', 'id')[:n + 1])
+            has_next = len(page) > n
+            page = page[:n]
+            has_previous = direction is not None and (not page or Response.objects.filter(
+                _before((page[0].pub_date, page[0].id)), thread=thread).exists())
+
+        if self.request.user.is_authenticated:
+            ThreadRead.mark(self.request.user.member, thread, max((response.id for response in page), default=0))
+        return {
+            'responses': page,
+            'previous_response': page[0].id if page and has_previous else None,
+            'next_response': page[-1].id if page and has_next else None,
+        }
+
+
+def _after(cursor, inclusive=False):
+    pub_date, id_ = cursor
+    ids = Q(id__gte=id_) if inclusive else Q(id__gt=id_)
+    return Q(pub_date__gt=pub_date) | Q(pub_date=pub_date) & ids
+
+
+def _before(cursor):
+    pub_date, id_ = cursor
+    return Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=id_)
+
+
+class ViewThread(ResponsePageMixin, AccessMixin, SuccessMessageMixin, CreateView):
     model = Response
     form_class = ResponseForm
     template_name = "forum/thread.html"
@@ -106,10 +183,9 @@ class ViewThread(AccessMixin, SuccessMessageMixin, CreateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context.update({
-            'thread': get_object_or_404(Thread, id=self.kwargs['thread']),
-            'responses': Response.objects.filter(thread=self.kwargs['thread']).order_by('pub_date'),
-        })
+        thread = get_object_or_404(Thread.objects.select_related('forum', 'author__equiv_user'), id=self.kwargs['thread'])
+        context['thread'] = thread
+        context.update(self.get_response_page(thread))
         return context
 
     def form_valid(self, form):
@@ -126,19 +202,25 @@ class ViewThread(AccessMixin, SuccessMessageMixin, CreateView):
         form.instance.thread = thread
         response = super().form_valid(form)
         # Create Notifications
-        url = reverse('forum:viewthread', kwargs={'thread': self.kwargs['thread']}) + "#response-" + str(
-            form.instance.id)
-        for author in thread.subscribed.all():
-            if author != self.request.user.member:
-                notify(author, NotifType.FORUM_REPLY,
-                       '{} replied to a thread you\'ve subscribed to!'.format(
-                           self.request.user.username), url,
-                       thread.id)
-        if self.request.user.member not in thread.subscribed.all():
-            thread.subscribed.add(self.request.user.member)
+        member = self.request.user.member
+        notify_members(thread.subscribed.exclude(id=member.id), NotifType.FORUM_REPLY,
+                       '{} replied to a thread you\'ve subscribed to!'.format(self.request.user.username),
+                       form.instance.get_absolute_url(), thread.id)
+        # add() skips anybody already subscribed
+        thread.subscribed.add(member)
         return response
 
 
+class ThreadResponses(ResponsePageMixin, View):
+    """A page of responses rendered for appending to the thread as the reader scrolls, see ResponsePageMixin"""
+
+    def get(self, request, *args, **kwargs):
+        thread = get_object_or_404(Thread, id=self.kwargs['thread'])
+        page = self.get_response_page(thread)
+        html = render_to_string("forum/parts/response_page.html", dict(page, thread=thread), request=request)
+        return JsonResponse({'html': html, 'next': page['next_response']})
+
+
 class ChangeSubscription(LoginRequiredMixin, View):
     def post(self, request, *args, **kwargs):
         sub = True if 'subscribe' in request.POST else False
@@ -154,6 +236,13 @@ class ChangeSubscription(LoginRequiredMixin, View):
         return HttpResponseRedirect(thread.get_absolute_url())
 
 
+class MarkForumRead(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        forum = get_object_or_404(Forum, id=self.kwargs['forum'])
+        ForumRead.mark(request.user.member, forum)
+        return HttpResponseRedirect(reverse('forum:subforum', args=(forum.id,)))
+
+
 class DeleteThread(LoginRequiredMixin, UserPassesTestMixin, SuccessMessageMixin, DeleteView):
     model = Thread
     success_message = "Thread Deleted"
@@ -1,5 +1,9 @@
 from django.db import models
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from django.utils.safestring import mark_safe
 
+from templatetags.rendering import render
 from users.models import Member
 
 
@@ -32,6 +36,8 @@ class Message(models.Model):
     thread = models.ForeignKey(MessageThread, on_delete=models.CASCADE)
     sender = models.ForeignKey(Member, on_delete=models.CASCADE)
     content = models.CharField(blank=False, max_length=4096)
+    # content as parse_md renders it, refreshed on save
+    content_html = models.TextField(blank=True, editable=False)
     timestamp = models.DateTimeField(auto_now_add=True)
     deleted = models.DateTimeField(null=True, blank=True)
 
@@ -44,6 +50,9 @@ class Message(models.Model):
     def reports(self):
         return self.messagereport_set.filter(resolved=False)
 
+    def get_content_html(self):
+        return mark_safe(self.content_html or render(self.content))
+
 
 class MessageReport(models.Model):
     member = models.ForeignKey(Member, on_delete=models.CASCADE)
@@ -55,3 +64,8 @@ class MessageReport(models.Model):
 
     def __str__(self):
         return f"{self.member.username}: {self.message.content[:35]}"
+
+
+@receiver(pre_save, sender=Message)
+def message_saving(sender, instance, **kwargs):
+    instance.content_html = render(instance.content)
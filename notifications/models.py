@@ -82,23 +82,25 @@ class NotificationSubscriptions(models.Model):
     other = models.IntegerField(verbose_name='Miscellaneous',
                                 choices=reduced_subscription_types, default=SubType.NONE)
 
+    # The field holding each category's setting
+    category_fields = {
+        NotifType.NEWSLETTER: 'newsletter',
+        NotifType.MESSAGE: 'message',
+        NotifType.LOAN_REQUESTS: 'loan_request',
+        NotifType.RPG_JOIN: 'rpg_join',
+        NotifType.RPG_LEAVE: 'rpg_leave',
+        NotifType.RPG_KICK: 'rpg_kick',
+        NotifType.RPG_ADDED: 'rpg_add',
+        NotifType.FORUM_REPLY: 'forum_reply',
+        NotifType.RPG_CREATE: 'rpg_new',
+        NotifType.ACHIEVEMENTS: 'achievement_got',
+        NotifType.OTHER: 'other'
+    }
+
     def get_category_subscription(self, category):
         # Map setting value to its ID value
-        mapping = {
-            NotifType.NEWSLETTER: self.newsletter,
-            NotifType.MESSAGE: self.message,
-            NotifType.LOAN_REQUESTS: self.loan_request,
-            NotifType.RPG_JOIN: self.rpg_join,
-            NotifType.RPG_LEAVE: self.rpg_leave,
-            NotifType.RPG_KICK: self.rpg_kick,
-            NotifType.RPG_ADDED: self.rpg_add,
-            NotifType.FORUM_REPLY: self.forum_reply,
-            NotifType.RPG_CREATE: self.rpg_new,
-            NotifType.ACHIEVEMENTS: self.achievement_got,
-            NotifType.OTHER: self.other
-        }
-
-        return mapping.get(category, SubType.NONE)
+        field = self.category_fields.get(category)
+        return getattr(self, field) if field is not None else SubType.NONE
 
     def set_category_subscription(self, category, value):
         # Map setting value to its ID value
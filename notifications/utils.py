@@ -33,11 +33,16 @@ def create_notification_if_subbed(member, notif_type, content, url, merge_key=No
 
 
 def delete_old(member):
+    delete_old_for([member])
+
+
+def delete_old_for(members):
+    # As delete_old, for several members (or their ids) at once
     week_ago = timezone.now() - timedelta(days=7)
     year_ago = timezone.now() - timedelta(days=365)
     Notification.objects.filter(
-        member=member, is_unread=False, time__lt=week_ago).delete()
-    Notification.objects.filter(member=member, time__lt=year_ago).delete()
+        member__in=members, is_unread=False, time__lt=week_ago).delete()
+    Notification.objects.filter(member__in=members, time__lt=year_ago).delete()
 
 
 def delete_all_old():
@@ -56,6 +61,33 @@ def notify_bulk(members, notif_type, content, url, merge_key=None):
     delete_all_old()
 
 
+def notify_members(members, notif_type, content, url, merge_key=None):
+    """
+    notify() for every member of a queryset in a constant number of queries, however many there are:
+    their subscriptions are read in one join, any missing are created together,
+    and the notifications are inserted with one bulk_create.
+    """
+    field = NotificationSubscriptions.category_fields.get(notif_type)
+    if field is None:
+        return
+    default = NotificationSubscriptions._meta.get_field(field).default
+    chosen = list(members.values_list('id', 'notificationsubscriptions__' + field))
+
+    # Members without subscriptions get the defaults, as get_or_create would give them
+    NotificationSubscriptions.objects.bulk_create(
+        [NotificationSubscriptions(member_id=member_id) for member_id, setting in chosen if setting is None],
+        ignore_conflicts=True)
+    member_ids = [member_id for member_id, setting in chosen
+                  if (default if setting is None else setting) != SubType.NONE]
+    if member_ids:
+        now = timezone.now()
+        Notification.objects.bulk_create(
+            Notification(member_id=member_id, notif_type=notif_type, content=content, url=url, is_unread=True,
+                         is_emailed=False, merge_key=merge_key, time=now)
+            for member_id in member_ids)
+        delete_old_for(member_ids)
+
+
 def notify_everybody(notif_type, content, url, merge_key=None):
     notify_bulk(Member.objects.all(), notif_type, content, url, merge_key)
 
@@ -0,0 +1,16 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from templatetags.markdown_benchmark import compare
+
+
+class Command(BaseCommand):
+    help = 'Times rendering typical markdown with and without pooled renderers, writing one JSON result per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=200, help='Renders per timing run')
+
+    def handle(self, *args, **options):
+        for result in compare(options['number']):
+            self.stdout.write(json.dumps(result))
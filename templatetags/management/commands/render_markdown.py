@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from forum.models import Thread, Response
+from messaging.models import Message
+from templatetags.rendering import render
+
+# (model, markdown field, rendered field)
+RENDERED = [
+    (Thread, 'body', 'body_html'),
+    (Response, 'body', 'body_html'),
+    (Message, 'content', 'content_html'),
+]
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Renders the stored HTML of every post and message again, for after rendering changes'
+
+    def handle(self, *args, **options):
+        for model, source, target in RENDERED:
+            batch = []
+            for obj in model.objects.only('id', source).iterator():
+                setattr(obj, target, render(getattr(obj, source)))
+                batch.append(obj)
+                if len(batch) == BATCH_SIZE:
+                    model.objects.bulk_update(batch, [target])
+                    batch = []
+            model.objects.bulk_update(batch, [target])
+            self.stdout.write('Rendered {} {}'.format(model.objects.count(), model._meta.verbose_name_plural))
+        self.stdout.write(self.style.SUCCESS('Markdown rendered'))
@@ -0,0 +1,78 @@
+import timeit
+
+from bleach.sanitizer import Cleaner
+from markdown import markdown
+
+from .rendering import VARIANTS, ALLOWED, ALLOWED_IMGLESS, exts, safe_exts, break_tags
+
+"""
+Markdown rendering micro-benchmark
+
+Times rendering typical texts the way the filters used to, building a Markdown and a Cleaner for every call,
+against the per-thread Pipelines in rendering (skipping its cache, which would make repeat calls free).
+"""
+
+BODIES = {
+    'message': "See you at the *games night* tonight? Bring snacks ^^please^^",
+    'thread': """Hi all,
+
+We're starting a new **D&D 5e** campaign on Thursdays. Things to know:
+
+1. Sessions run 7pm till 10pm
+2. Level 3 characters, standard array
+3. ~~No~~ Limited homebrew, ask first
+
+Character sheets are on [the wiki](https://example.com/wiki) and questions can go below.
+> The dungeon awaits!
+""",
+    'newsletter': "\n\n".join(
+        """## Week {0} {{: .newsletter-heading }}
+
+![Banner](https://example.com/banner{0}.png)
+
+This week we have *board games* on Monday, **roleplaying** on Wednesday and a ^^special^^ event on Friday.
+Don't forget to sign up at [the events page](https://example.com/events/{0}).
+
+- Item one
+- Item two
+    - Nested item
+
+```
+code block {0}
+```
+""".format(week) for week in range(8)),
+}
+
+# What the filters did before rendering was pooled
+PER_CALL = {
+    'md': lambda text: Cleaner(**ALLOWED).clean(markdown(break_tags(text), extensions=exts, output_format='html5')),
+    'text': lambda text: Cleaner(**ALLOWED_IMGLESS).clean(
+        markdown(break_tags(text), extensions=exts, output_format='html5')),
+    'safe': lambda text: markdown(text, extensions=safe_exts, output_format='html5'),
+}
+
+# The variant each kind of text is normally rendered with
+TYPICAL = {'message': 'md', 'thread': 'md', 'newsletter': 'safe'}
+
+
+def time_call(render, text, number):
+    """Seconds per call, the best of three runs"""
+    return min(timeit.repeat(lambda: render(text), number=number, repeat=3)) / number
+
+
+def compare(number=200):
+    """Yields a result dict per body, checking that both ways render it identically"""
+    for name, text in BODIES.items():
+        variant = TYPICAL[name]
+        per_call, pooled = PER_CALL[variant], VARIANTS[variant]
+        if per_call(text) != pooled(text):
+            raise AssertionError("Pooled rendering of {} differs".format(name))
+        before, after = time_call(per_call, text, number), time_call(pooled, text, number)
+        yield {
+            'body': name,
+            'variant': variant,
+            'length': len(text),
+            'per_call_us': round(before * 1e6, 1),
+            'pooled_us': round(after * 1e6, 1),
+            'speedup': round(before / after, 2),
+        }
@@ -0,0 +1,150 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from bleach.sanitizer import Cleaner
+from django.conf import settings
+from django.core.cache import caches
+from markdown import Markdown
+
+"""
+Rendering user markdown
+
+Rendering is slow next to everything else on a page, and the same few texts (signatures, bios, descriptions)
+turn up again and again, so rendered HTML is cached by variant and a hash of the text.
+Each process keeps the most recently used in memory, and with settings.MARKDOWN_CACHE naming a cache
+they're also shared between processes through it.
+
+Loading extensions and building a sanitiser cost more than rendering a short message, so each thread builds
+a Markdown and a Cleaner once per variant and reuses them (neither is safe to share between threads).
+"""
+
+exts = ['markdown.extensions.nl2br',
+        'pymdownx.caret', 'pymdownx.tilde', 'sane_lists']
+safe_exts = ['pymdownx.caret', 'pymdownx.tilde', 'sane_lists', 'attr_list']
+
+# Change when rendering changes, so that nothing rendered the old way is used
+RENDER_VERSION = 1
+# Rendered HTML held in each process, in characters
+MAX_SIZE = 8 * 1024 * 1024
+
+
+def break_tags(text):
+    # Provides no security, but makes casual tag insertion fail
+    return text.replace('<', '&lt;')
+
+
+# Sanitiser allow-lists
+ALLOWED = {
+    'tags': ['p', 'br', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'em', 'strong', 'a', 'ul', 'ol', 'li',
+             'blockquote', 'img', 'pre', 'code', 'hr', 'del'],
+    'attributes': {'a': ['href'], 'img': ['src', 'alt']},
+    'protocols': ['http', 'https'],
+}
+ALLOWED_IMGLESS = {
+    'tags': ['p', 'br', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'em', 'strong', 'a', 'ul', 'ol', 'li',
+             'blockquote', 'pre', 'code', 'hr', 'del'],
+    'attributes': {'a': ['href']},
+    'protocols': ['http', 'https'],
+    'strip': True,
+}
+
+
+class Pipeline:
+    """
+    Renders markdown with the given extensions, then sanitises it with the given Cleaner arguments if any,
+    using a Markdown and a Cleaner built once in each thread.
+    """
+
+    def __init__(self, extensions, allowed=None, escape_tags=True):
+        self.extensions = extensions
+        self.allowed = allowed
+        self.escape_tags = escape_tags
+        self.local = threading.local()
+
+    def _built(self):
+        local = self.local
+        if not hasattr(local, 'markdown'):
+            local.markdown = Markdown(extensions=self.extensions, output_format='html5')
+            local.cleaner = Cleaner(**self.allowed) if self.allowed is not None else None
+        return local.markdown, local.cleaner
+
+    def __call__(self, text):
+        md, cleaner = self._built()
+        # resetting clears anything left over from the last text, such as footnotes or abbreviations
+        html = md.reset().convert(break_tags(text) if self.escape_tags else text)
+        return cleaner.clean(html) if cleaner is not None else html
+
+
+# How each variant is rendered, by name
+VARIANTS = {
+    'md': Pipeline(exts, ALLOWED),
+    'text': Pipeline(exts, ALLOWED_IMGLESS),
+    # WITHOUT escaping
+    'safe': Pipeline(safe_exts, escape_tags=False),
+}
+
+
+class RenderCache:
+    """Least recently used rendered HTML, up to max_size characters of it, backed by an optional shared cache"""
+
+    def __init__(self, max_size=MAX_SIZE, shared=None, variants=VARIANTS):
+        self.max_size = max_size
+        self.shared = shared
+        self.variants = variants
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(variant, text):
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return "markdown:{}:{}:{}".format(RENDER_VERSION, variant, digest)
+
+    def render(self, variant, text):
+        key = self.key(variant, text)
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                return html
+
+        html = self.shared.get(key) if self.shared is not None else None
+        if html is None:
+            html = self.variants[variant](text)
+            if self.shared is not None:
+                self.shared.set(key, html)
+
+        if len(html) <= self.max_size:
+            with self.lock:
+                if key not in self.entries:
+                    self.entries[key] = html
+                    self.size += len(html)
+                while self.size > self.max_size:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return html
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        shared = getattr(settings, 'MARKDOWN_CACHE', None)
+        _cache = RenderCache(shared=caches[shared] if shared else None)
+    return _cache
+
+
+def render(text, variant='md'):
+    """
+    The HTML for markdown text as the parse_md (variant 'md'), parse_md_text ('text') or parse_md_safe ('safe')
+    filters would give it, but not marked safe.
+    """
+    return get_cache().render(variant, str(text))
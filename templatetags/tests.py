@@ -1,3 +1,62 @@
+from django.core.cache import caches
 from django.test import TestCase
 
-# Create your tests here.
+from . import rendering
+from .markdown_benchmark import BODIES, PER_CALL
+from .rendering import RenderCache
+from .templatetags.markdown_tags import parse_md, parse_md_text, parse_md_safe
+
+
+def counting_cache(**kwargs):
+    """A RenderCache noting down the texts it actually renders in .rendered"""
+    rendered = []
+
+    def counted(name, render):
+        def variant(text):
+            rendered.append((name, text))
+            return render(text)
+        return variant
+
+    cache = RenderCache(variants={name: counted(name, render) for name, render in rendering.VARIANTS.items()},
+                        **kwargs)
+    cache.rendered = rendered
+    return cache
+
+
+class RenderCaching(TestCase):
+    def test_filters(self):
+        text = "**Hi** <script>alert(1)</script> ![img](https://example.com/a.png)"
+        self.assertEqual(parse_md(text), '<p><strong>Hi</strong> &lt;script&gt;alert(1)&lt;/script&gt; '
+                                         '<img alt="img" src="https://example.com/a.png"></p>')
+        self.assertNotIn('<img', parse_md_text(text))
+        self.assertIn('<script>', parse_md_safe(text))
+
+    def test_lru(self):
+        cache = counting_cache(max_size=100)
+        html = cache.render('md', "*one*")
+        self.assertEqual(cache.render('md', "*one*"), html)
+        cache.render('safe', "*one*")
+        self.assertEqual(cache.rendered, [('md', "*one*"), ('safe', "*one*")])
+
+        # pushing out the least recently used
+        for i in range(10):
+            cache.render('md', "text number {}".format(i))
+        self.assertLessEqual(cache.size, 100)
+        cache.render('md', "*one*")
+        self.assertEqual(cache.rendered.count(('md', "*one*")), 2)
+
+    def test_shared(self):
+        shared = caches['default']
+        shared.clear()
+        first, second = counting_cache(shared=shared), counting_cache(shared=shared)
+        self.assertEqual(first.render('text', "shared"), second.render('text', "shared"))
+        self.assertEqual((len(first.rendered), len(second.rendered)), (1, 0))
+
+
+class Pooling(TestCase):
+    def test_same_as_per_call(self):
+        # twice over, so that reused renderers are compared too
+        for _ in range(2):
+            for text in BODIES.values():
+                for variant, render in PER_CALL.items():
+                    self.assertEqual(rendering.VARIANTS[variant](text), render(text))
@@ -1,7 +1,8 @@
 from django.conf import settings  # import the settings file
+from django.utils.functional import SimpleLazyObject
 from operator import itemgetter
 
-from forum.models import Thread, Response
+from forum.recent import get_recent
 from navbar.models import BarDropdown, BarItem
 
 
@@ -10,9 +11,10 @@ def add_debug(request):
 
 
 def latestposts(request):
+    # Only looked up if a template uses them, and then usually from the cache
     return {
-        'latestthreads': Thread.objects.order_by('-pub_date')[:5],
-        'latestresponses': Response.objects.order_by('-pub_date')[:5],
+        'latestthreads': SimpleLazyObject(lambda: get_recent()['threads']),
+        'latestresponses': SimpleLazyObject(lambda: get_recent()['responses']),
     }
 
 
@@ -229,6 +229,13 @@ MESSAGE_TAGS = {
 
 MEMBERSHIP_API_KEY = ""
 
+# Name of a cache in CACHES to share rendered markdown between processes through, None to keep it per process
+MARKDOWN_CACHE = None
+
+# Name of a cache in CACHES to keep recent forum posts in, shared between processes so that all of them
+# hear about new posts; None to use the default cache for only a short while
+RECENT_POSTS_CACHE = None
+
 # Allow local configuration (change deploy options etc.)
 try:
     from .local_config import *
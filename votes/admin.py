@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Election, Candidate, Ticket, FPTPVote, APRVVote, STVVote, STVPreference, STVResult
+from .models import Election, Candidate, Ticket, FPTPVote, APRVVote, STVVote, STVPreference, STVResult, ElectionStats
 
 
 def archive(modeladmin, request, queryset):
@@ -9,6 +9,25 @@ def archive(modeladmin, request, queryset):
 archive.short_description = "Archive selected elections (if closed)"
 
 
+class StatsAdmin(admin.ModelAdmin):
+    """Tickets and votes changed here bypass issuing and casting, so their elections' statistics are counted again"""
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # a ticket can be moved to another election, leaving the one it came from to count again too
+        for election_id in {obj.election_id, form.initial.get('election')} - {None}:
+            ElectionStats.rebuild(election_id)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ElectionStats.rebuild(obj.election_id)
+
+    def delete_queryset(self, request, queryset):
+        election_ids = set(queryset.values_list('election_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for election_id in election_ids:
+            ElectionStats.rebuild(election_id)
+
+
 class PreferenceInline(admin.StackedInline):
     model = STVPreference
     readonly_fields = ['order', 'candidate']
@@ -21,23 +40,23 @@ class CandidateInline(admin.StackedInline):
     extra = 1
 
 
-class FPTPVoteAdmin(admin.ModelAdmin):
+class FPTPVoteAdmin(StatsAdmin):
     readonly_fields = ['election', 'uuid', 'time', 'selection']
     search_fields = ['uuid']
 
 
-class TicketAdmin(admin.ModelAdmin):
+class TicketAdmin(StatsAdmin):
     search_fields = ['uuid']
 
 
-class STVVoteAdmin(admin.ModelAdmin):
+class STVVoteAdmin(StatsAdmin):
     inlines = [PreferenceInline]
     readonly_fields = ['election', 'uuid', 'time', 'selection']
     search_fields = ['uuid']
 
 
 class STVResultAdmin(admin.ModelAdmin):
-    readonly_fields = ['election', 'full_log', 'winners', 'generated']
+    readonly_fields = ['election', 'status', 'log_text', 'winners', 'generated']
 
 
 class ElectionAdmin(admin.ModelAdmin):
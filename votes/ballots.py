@@ -0,0 +1,57 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Ticket, ElectionStats, FPTPVote, APRVVote, STVVote, STVPreference
+
+"""
+Ballot casting
+
+Each ballot is written in one transaction that starts by spending the voter's ticket.
+Spending is a conditional update, which takes the row lock, so of any number of simultaneous
+submissions on the same ticket exactly one gets to write a vote and the rest are rejected.
+"""
+
+
+class AlreadyVoted(Exception):
+    """The ticket has been spent, or its election has closed"""
+    pass
+
+
+def _spend(ticket):
+    if not Ticket.objects.filter(id=ticket.id, spent=False, election__open=True).update(spent=True):
+        raise AlreadyVoted(ticket.uuid)
+    ticket.spent = True
+
+
+def _counted(ticket):
+    ElectionStats.add(ticket.election_id, tickets_spent=1, votes_cast=1, last_vote=timezone.now())
+
+
+def cast_fptp(ticket, selection):
+    """Votes for the candidate with id selection"""
+    with transaction.atomic():
+        _spend(ticket)
+        vote = FPTPVote.objects.create(uuid=ticket.uuid, election_id=ticket.election_id, selection_id=selection)
+        _counted(ticket)
+        return vote
+
+
+def cast_approval(ticket, selection):
+    """Approves of the candidates with ids in selection"""
+    with transaction.atomic():
+        _spend(ticket)
+        vote = APRVVote.objects.create(uuid=ticket.uuid, election_id=ticket.election_id)
+        vote.selection.add(*selection)
+        _counted(ticket)
+        return vote
+
+
+def cast_stv(ticket, preferences):
+    """Ranks candidates, preferences being (candidate id, order) pairs"""
+    with transaction.atomic():
+        _spend(ticket)
+        vote = STVVote.objects.create(uuid=ticket.uuid, election_id=ticket.election_id)
+        STVPreference.objects.bulk_create(
+            STVPreference(stvvote=vote, candidate_id=candidate, order=order) for candidate, order in preferences)
+        _counted(ticket)
+        return vote
@@ -0,0 +1,226 @@
+import io
+import struct
+import uuid
+from collections import Counter
+from itertools import islice, repeat, chain
+from typing import Iterable, List, Tuple
+
+from django.db import transaction
+
+from .models import Election, Candidate, STVVote, STVPreference, ElectionStats
+
+"""
+BLT ballot files
+
+BLT is the usual interchange format for STV ballots:
+    <candidates> <seats>
+    -<withdrawn candidate> ...              (optional)
+    <weight> <preference> ... 0             (one line per ballot)
+    0
+    "<candidate name>"                      (one line per candidate)
+    "<title>"
+Candidates are numbered from 1 in the order their names are given.
+
+The binary variant holds the same things in far less space:
+a magic number, then candidates, seats and the withdrawn candidates as unsigned shorts,
+then each ballot as an unsigned int weight, an unsigned byte length and that many preferences
+(unsigned bytes, or unsigned shorts if there are more than 255 candidates), so a ballot holds at most 255,
+ending with a zero weight, then the names and title as length prefixed UTF-8.
+
+Files are read and written a ballot at a time, so their size doesn't matter.
+"""
+
+MAGIC = b'BLT\x01'
+_short = struct.Struct('<H')
+_ballot = struct.Struct('<IB')
+# Most preferences the length byte of a binary ballot can count
+MAX_BINARY_PREFERENCES = 255
+
+
+class BltError(ValueError):
+    pass
+
+
+def _preference(candidates: int) -> str:
+    """struct format of a preference in the binary variant"""
+    return 'B' if candidates < 256 else 'H'
+
+
+class BltReader:
+    """
+    Reads a text or binary BLT file, telling them apart by the magic number.
+    The header is read straight away. ballots() then streams the ballots,
+    and once they're exhausted names and title are filled in.
+    """
+
+    def __init__(self, file):
+        """file is opened in binary mode"""
+        if not hasattr(file, 'peek'):
+            file = io.BufferedReader(file)
+        self.binary = file.peek(len(MAGIC))[:len(MAGIC)] == MAGIC
+        self.names = None
+        self.title = None
+        if self.binary:
+            self.file = file
+            file.read(len(MAGIC))
+            self.candidates, self.seats, withdrawn = struct.unpack('<HHH', self._read(6))
+            self.withdrawn = {self._read_short() for _ in range(withdrawn)}
+            self.preference = _preference(self.candidates)
+        else:
+            self.file = io.TextIOWrapper(file, encoding='utf-8')
+            self.lines = filter(None, map(str.strip, self.file))
+            try:
+                self.candidates, self.seats = map(int, next(self.lines).split())
+                line = next(self.lines)
+            except (StopIteration, ValueError):
+                raise BltError("Missing or malformed header")
+            self.withdrawn = set()
+            if line.startswith('-'):
+                try:
+                    self.withdrawn = {-int(token) for token in line.split()}
+                except ValueError:
+                    raise BltError(f"Malformed withdrawn candidates {line!r}")
+                line = next(self.lines, '0')
+            self.first_ballot = line
+        if not all(1 <= candidate <= self.candidates for candidate in self.withdrawn):
+            raise BltError(f"Unknown withdrawn candidate in {sorted(self.withdrawn)}")
+
+    def _read(self, size: int) -> bytes:
+        data = self.file.read(size)
+        if len(data) != size:
+            raise BltError("File ends too soon")
+        return data
+
+    def _read_short(self) -> int:
+        return _short.unpack(self._read(2))[0]
+
+    def _read_string(self) -> str:
+        return self._read(self._read_short()).decode('utf-8')
+
+    def _check(self, prefs: Tuple[int]) -> Tuple[int]:
+        if not all(0 < pref <= self.candidates for pref in prefs):
+            raise BltError(f"Unknown candidate in {prefs}")
+        return prefs
+
+    def ballots(self) -> Iterable[Tuple[int, Tuple[int]]]:
+        """Yields (weight, preferences) for each ballot, preferences being candidate numbers"""
+        if self.binary:
+            size = struct.calcsize(self.preference)
+            while True:
+                weight, length = _ballot.unpack(self._read(_ballot.size))
+                if not weight:
+                    break
+                prefs = struct.unpack(f'<{length}{self.preference}', self._read(size * length))
+                yield weight, self._check(prefs)
+            self.names = [self._read_string() for _ in range(self.candidates)]
+            self.title = self._read_string()
+        else:
+            for line in chain([self.first_ballot], self.lines):
+                # Some writers label ballots with an id in brackets
+                tokens = [token for token in line.split() if not token.startswith('(')]
+                try:
+                    numbers = list(map(int, tokens))
+                except ValueError:
+                    raise BltError(f"Unsupported ballot {line!r}, "
+                                   f"equal preferences and fractional weights can't be counted")
+                if numbers == [0]:
+                    break
+                if len(numbers) < 2 or numbers[-1] != 0:
+                    raise BltError(f"Malformed ballot {line!r}")
+                yield numbers[0], self._check(tuple(numbers[1:-1]))
+            strings = [line.strip('"') for line in islice(self.lines, self.candidates + 1)]
+            if len(strings) != self.candidates + 1:
+                raise BltError("Missing candidate names or title")
+            self.names, self.title = strings[:-1], strings[-1]
+
+    def votes(self) -> Iterable[Tuple[int]]:
+        """Yields the preferences of every ballot, repeated by weight"""
+        return chain.from_iterable(repeat(prefs, weight) for weight, prefs in self.ballots())
+
+    def counts(self) -> Counter:
+        """Folds the ballots into a Counter of preferences -> number of ballots, ready for stv.BallotSet"""
+        counts = Counter()
+        for weight, prefs in self.ballots():
+            counts[prefs] += weight
+        return counts
+
+
+def write_blt(file, names: List[str], seats: int, ballots: Iterable[Tuple[int, Tuple[int]]],
+              withdrawn: Iterable[int] = (), title: str = "", binary: bool = False):
+    """
+    Writes ballots, given as (weight, preferences) with candidates numbered from 1, to a file opened in binary mode.
+    """
+    withdrawn = sorted(withdrawn)
+    if binary:
+        file.write(MAGIC)
+        file.write(struct.pack(f'<HHH{len(withdrawn)}H', len(names), seats, len(withdrawn), *withdrawn))
+        preference = _preference(len(names))
+        for weight, prefs in ballots:
+            if len(prefs) > MAX_BINARY_PREFERENCES:
+                raise BltError(f"A binary ballot holds at most {MAX_BINARY_PREFERENCES} preferences, not {len(prefs)}")
+            file.write(struct.pack(f'<IB{len(prefs)}{preference}', weight, len(prefs), *prefs))
+        file.write(_ballot.pack(0, 0))
+        for string in chain(names, [title]):
+            data = string.encode('utf-8')
+            file.write(_short.pack(len(data)))
+            file.write(data)
+    else:
+        text = io.TextIOWrapper(file, encoding='utf-8', newline='\n', write_through=True)
+        text.write(f"{len(names)} {seats}\n")
+        if withdrawn:
+            text.write(" ".join(f"-{candidate}" for candidate in withdrawn) + "\n")
+        for weight, prefs in ballots:
+            text.write(" ".join(map(str, chain([weight], prefs, [0]))) + "\n")
+        text.write("0\n")
+        for string in chain(names, [title]):
+            text.write(f'"{string}"\n')
+        # Leave the file open for whoever passed it in
+        text.detach()
+
+
+def export_election(election: Election, file, binary: bool = False):
+    """Writes an STV election's ballots, candidates numbered in id order"""
+    candidates = list(election.candidate_set.order_by('id'))
+    numbers = {candidate.id: number for number, candidate in enumerate(candidates, 1)}
+    # ballots() only finds votes through their preferences, so votes without any are written separately
+    empty = election.stvvote_set.filter(stvpreference__isnull=True).count()
+    write_blt(file, [candidate.name for candidate in candidates], election.seats,
+              chain(((1, tuple(map(numbers.get, ballot))) for ballot in election.ballots()),
+                    [(empty, ())] if empty else []),
+              withdrawn=(numbers[c.id] for c in candidates if c.state == Candidate.State.WITHDRAWN),
+              title=election.name, binary=binary)
+
+
+def import_election(file, batch_size: int = 1000) -> Election:
+    """Creates a closed STV election from a BLT file, with a vote for every ballot"""
+    reader = BltReader(file)
+    with transaction.atomic():
+        election = Election.objects.create(name="Imported election", description="",
+                                           vote_type=Election.Types.STV, seats=reader.seats)
+        # Names come after the ballots, so are filled in at the end
+        candidates = [
+            Candidate.objects.create(name=f"Candidate {number}", election=election,
+                                     state=Candidate.State.WITHDRAWN if number in reader.withdrawn
+                                     else Candidate.State.STANDING)
+            for number in range(1, reader.candidates + 1)]
+
+        votes = reader.votes()
+        while True:
+            batch = [(uuid.uuid4(), prefs) for prefs in islice(votes, batch_size)]
+            if not batch:
+                break
+            STVVote.objects.bulk_create(STVVote(election=election, uuid=id_) for id_, _ in batch)
+            # Not every database hands back the ids of bulk inserted rows
+            ids = dict(STVVote.objects.filter(uuid__in=[id_ for id_, _ in batch]).values_list('uuid', 'id'))
+            STVPreference.objects.bulk_create(
+                STVPreference(stvvote_id=ids[id_], candidate=candidates[number - 1], order=order)
+                for id_, prefs in batch for order, number in enumerate(prefs, 1))
+
+        for candidate, name in zip(candidates, reader.names):
+            candidate.name = name[:Candidate._meta.get_field('name').max_length]
+        Candidate.objects.bulk_update(candidates, ['name'])
+        election.name = reader.title[:Election._meta.get_field('name').max_length] or election.name
+        election.save()
+        # votes were bulk inserted, so nothing has counted them yet
+        ElectionStats.rebuild(election.id)
+    return election
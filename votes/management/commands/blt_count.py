@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from votes.blt import BltReader, BltError
+from votes.stv import Election, BallotSet, ElectionError
+from votes.stv_benchmark import ENGINES
+
+
+class Command(BaseCommand):
+    help = 'Counts the ballots in a BLT file (text or binary) without touching the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+        parser.add_argument('--seats', type=int, help="Seats to fill, instead of the file's")
+        parser.add_argument('--engine', choices=list(ENGINES), default='trie')
+        parser.add_argument('--log', action='store_true', help='Print the count round by round')
+
+    def handle(self, *args, **options):
+        backend, arithmetic = ENGINES[options['engine']]
+        with open(options['file'], 'rb') as file:
+            try:
+                reader = BltReader(file)
+                ballots = BallotSet(range(1, reader.candidates + 1), reader.counts())
+            except (BltError, ElectionError) as e:
+                raise CommandError(e)
+        calc = Election(ballots.candidates, ballots, options['seats'] or reader.seats, backend=backend,
+                        arithmetic=arithmetic and arithmetic(), log=options['log'])
+        calc.withdraw(reader.withdrawn)
+        calc.full_election()
+
+        if options['log']:
+            for line in calc.fulllog:
+                self.stdout.write(line)
+        self.stdout.write(f'{reader.title}: {ballots.total_votes} ballots, {calc.rounds} rounds')
+        for winner in sorted(calc.winners()):
+            self.stdout.write(self.style.SUCCESS(reader.names[winner - 1]))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from votes.blt import export_election
+from votes.models import Election
+
+
+class Command(BaseCommand):
+    help = "Writes an STV election's ballots to a BLT file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('election', type=int, help='Election id')
+        parser.add_argument('file')
+        parser.add_argument('--binary', action='store_true', help='Write the compact binary variant')
+
+    def handle(self, *args, **options):
+        try:
+            election = Election.objects.get(id=options['election'], vote_type=Election.Types.STV)
+        except Election.DoesNotExist:
+            raise CommandError('Not an STV election: ' + str(options['election']))
+        with open(options['file'], 'wb') as file:
+            export_election(election, file, binary=options['binary'])
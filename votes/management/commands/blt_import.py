@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from votes.blt import import_election, BltError
+
+
+class Command(BaseCommand):
+    help = 'Creates a closed STV election from a BLT file (text or binary)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+
+    def handle(self, *args, **options):
+        with open(options['file'], 'rb') as file:
+            try:
+                election = import_election(file)
+            except BltError as e:
+                raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {election} (id {election.id}) with {election.stvvote_set.count()} ballots'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from votes.models import Election, ElectionStats
+
+
+class Command(BaseCommand):
+    help = 'Recounts the turnout statistics of every election, for after tickets or votes are edited by hand'
+
+    def handle(self, *args, **options):
+        for election_id in Election.objects.values_list('id', flat=True):
+            ElectionStats.rebuild(election_id)
+        self.stdout.write(self.style.SUCCESS('Rebuilt statistics for {} elections'.format(Election.objects.count())))
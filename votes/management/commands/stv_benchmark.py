@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from votes.stv_benchmark import sweep, DISTRIBUTIONS, ENGINES
+
+
+class Command(BaseCommand):
+    help = 'Times the STV calculator on synthetic elections, writing one JSON result per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, nargs='+', default=[100, 1000, 10000])
+        parser.add_argument('--candidates', type=int, nargs='+', default=[4, 8, 12])
+        parser.add_argument('--seats', type=int, nargs='+', default=[1, 3])
+        parser.add_argument('--distributions', nargs='+', choices=list(DISTRIBUTIONS),
+                            default=list(DISTRIBUTIONS))
+        parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=['trie'])
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-memory', action='store_true',
+                            help='Skip the (slow) traced count used to measure peak memory')
+        parser.add_argument('--output', help='File to write results to instead of stdout')
+
+    def handle(self, *args, **options):
+        results = sweep(options['voters'], options['candidates'], options['seats'], options['distributions'],
+                        options['engines'], options['seed'], not options['no_memory'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                for result in results:
+                    output.write(json.dumps(result) + '\n')
+                    self.stderr.write('{distribution} {voters}x{candidates}x{seats} {engine}: '
+                                      '{wall_time:.3f}s'.format(**result))
+        else:
+            for result in results:
+                self.stdout.write(json.dumps(result))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from votes.models import Election, STVResult
+from votes.tasks import count_stv
+
+
+class Command(BaseCommand):
+    help = 'Counts (or recounts) closed STV elections in this process, storing the results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('elections', type=int, nargs='*', help='Election ids')
+        parser.add_argument('--all', action='store_true',
+                            help='Count every closed, unarchived STV election that has no finished result')
+        parser.add_argument('--force', action='store_true',
+                            help='Recount even if a result exists or a count looks to be in progress')
+
+    def handle(self, *args, **options):
+        elections = Election.objects.filter(vote_type=Election.Types.STV, open=False)
+        if options['all']:
+            elections = elections.filter(archived=False)
+            if not options['force']:
+                elections = elections.exclude(stvresult__status=STVResult.Status.DONE)
+        elif options['elections']:
+            elections = elections.filter(id__in=options['elections'])
+            missing = set(options['elections']) - set(elections.values_list('id', flat=True))
+            if missing:
+                raise CommandError('Not closed STV elections: ' + ', '.join(map(str, sorted(missing))))
+        else:
+            raise CommandError('Give some election ids or --all')
+
+        for election in elections:
+            STVResult.objects.get_or_create(election=election, defaults={'status': STVResult.Status.PENDING})
+            result = count_stv(election.id, force=options['force'])
+            if result is None:
+                self.stdout.write(f'{election}: skipped, already counted or being counted (use --force)')
+            else:
+                winners = ', '.join(map(str, result.winners.all()))
+                self.stdout.write(self.style.SUCCESS(f'{election}: {winners}'))
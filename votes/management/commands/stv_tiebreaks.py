@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from votes.models import Election, Candidate
+from votes.stv_tiebreaks import analyse
+
+
+class Command(BaseCommand):
+    help = 'Recounts a closed STV election under many random tiebreaks, showing how often each candidate wins'
+
+    def add_arguments(self, parser):
+        parser.add_argument('election', type=int, help='Election id')
+        parser.add_argument('--runs', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the first rerun')
+        parser.add_argument('--workers', type=int, help='Processes to use, by default one per CPU')
+
+    def handle(self, *args, **options):
+        try:
+            election = Election.objects.get(id=options['election'], vote_type=Election.Types.STV, open=False)
+        except Election.DoesNotExist:
+            raise CommandError('Not a closed STV election: ' + str(options['election']))
+        names = dict(election.candidate_set.values_list('id', 'name'))
+        withdrawn = election.candidate_set.filter(state=Candidate.State.WITHDRAWN).values_list('id', flat=True)
+
+        report = analyse(set(names), list(election.ballots()), election.seats, set(withdrawn),
+                         runs=options['runs'], seed=options['seed'], workers=options['workers'])
+
+        self.stdout.write(f"{election}: {report['runs']} reruns, {report['tied_runs']} needing a tiebreak")
+        if report['diverges_at'] is None:
+            self.stdout.write(self.style.SUCCESS('Every rerun gave the same result'))
+        else:
+            self.stdout.write(self.style.WARNING(f"Reruns first diverge in round {report['diverges_at']}"))
+        for candidate, wins in sorted(report['wins'].items(), key=lambda x: -x[1]):
+            self.stdout.write(f"{names[candidate]}: {wins / report['runs']:.1%}")
+        for winners, times in sorted(report['outcomes'].items(), key=lambda x: -x[1]):
+            self.stdout.write(f"{', '.join(names[w] for w in winners)}: {times / report['runs']:.1%}")
@@ -1,9 +1,25 @@
 import uuid as uuid
+from collections import namedtuple
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.cache import cache
 from django.db import models
+from django.db.models import Count, F, Max, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .stv import RoundLog
 
 from users.models import Member
 
 
+# turnout, and candidates annotated with vote_count (most votes first)
+Tally = namedtuple('Tally', ['turnout', 'choices'])
+
+
 # Create your models here.
 class Election(models.Model):
     class Types(models.IntegerChoices):
@@ -34,6 +50,41 @@ class Election(models.Model):
         else:
             raise NotImplemented()
 
+    def tally_cache_key(self):
+        return tally_cache_key(self.id)
+
+    def tally(self):
+        """
+        Counts the votes for each candidate in a plurality or approval election with one grouped query.
+        A closed election's votes can't change, so its tally is cached until the election is edited.
+        Edits only clear the cache in the process that made them, so cached tallies also expire after TALLY_TIMEOUT.
+        """
+        if not self.open:
+            cached = cache.get(self.tally_cache_key())
+            if cached is not None:
+                return cached
+        if self.vote_type == Election.Types.FPTP:
+            relation = 'fptpvote'
+        elif self.vote_type == Election.Types.APRV:
+            relation = 'aprvvote'
+        else:
+            raise ValueError("Only plurality and approval elections can be tallied")
+        choices = list(self.candidate_set.annotate(vote_count=Count(relation)).order_by('-vote_count', 'id'))
+        result = Tally(self.votes().count(), choices)
+        if not self.open:
+            cache.set(self.tally_cache_key(), result, TALLY_TIMEOUT)
+        return result
+
+    def ballots(self):
+        """
+        Yields each STV ballot as a tuple of candidate ids in preference order.
+        All preferences come from one ordered query and are grouped as they stream in, without creating model instances.
+        """
+        preferences = STVPreference.objects.filter(stvvote__election=self).order_by(
+            'stvvote_id', 'order').values_list('stvvote_id', 'candidate_id')
+        for _, ballot in groupby(preferences.iterator(), key=itemgetter(0)):
+            yield tuple(map(itemgetter(1), ballot))
+
     class Meta:
         ordering = ('id',)
 
@@ -105,10 +156,132 @@ class STVPreference(models.Model):
 
 
 class STVResult(models.Model):
+    class Status(models.IntegerChoices):
+        PENDING = 0, "Waiting to be counted"
+        RUNNING = 1, "Counting"
+        DONE = 2, "Counted"
+        FAILED = 3, "Count failed"
+
+    # A count running for longer than this is taken to have died with its process, and can be claimed again
+    STALE_AFTER = timedelta(minutes=15)
+
     election = models.OneToOneField(Election, on_delete=models.CASCADE)
-    full_log = models.TextField()
+    # Defaults to done as results stored before counting moved to the background are complete
+    status = models.IntegerField(choices=Status.choices, default=Status.DONE)
+    # Counts made before logs were structured only have full_log
+    log = models.JSONField(blank=True, null=True, editable=False)
+    full_log = models.TextField(blank=True)
     winners = models.ManyToManyField(Candidate)
     generated = models.DateTimeField(auto_now_add=True)
+    # When the latest count was claimed
+    started = models.DateTimeField(blank=True, null=True, editable=False)
 
     def __str__(self):
         return str(self.election)
+
+    @staticmethod
+    def claimable():
+        """Results waiting for a count, or whose count looks to have died"""
+        stale = Q(started__isnull=True) | Q(started__lt=timezone.now() - STVResult.STALE_AFTER)
+        return Q(status=STVResult.Status.PENDING) | Q(stale, status=STVResult.Status.RUNNING)
+
+    @property
+    def stalled(self):
+        return self.status == STVResult.Status.RUNNING and (
+            self.started is None or self.started < timezone.now() - STVResult.STALE_AFTER)
+
+    @property
+    def counting(self):
+        return self.status in (STVResult.Status.PENDING, STVResult.Status.RUNNING)
+
+    @property
+    def failed(self):
+        return self.status == STVResult.Status.FAILED
+
+    def log_text(self):
+        if self.log is None:
+            return self.full_log
+        return "\n".join(RoundLog.render(self.log))
+
+
+class ElectionStats(models.Model):
+    """
+    Running totals for an election, kept up to date as tickets are issued and ballots cast
+    so that turnout never needs the tickets or votes counting.
+    Changes made in the admin rebuild them, anything else changing tickets or votes directly should
+    call rebuild() or be followed by the election_stats command.
+    """
+    election = models.OneToOneField(Election, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    tickets_issued = models.IntegerField(default=0)
+    tickets_spent = models.IntegerField(default=0)
+    votes_cast = models.IntegerField(default=0)
+    last_vote = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return str(self.election)
+
+    @property
+    def turnout(self):
+        """Fraction of tickets spent"""
+        return self.tickets_spent / self.tickets_issued if self.tickets_issued else 0
+
+    @classmethod
+    def add(cls, election_id, last_vote=None, **counts):
+        """
+        Adds to an election's totals in a single update, call after the change being counted has been saved.
+        An election without a record has it built from scratch instead.
+        """
+        changes = {field: F(field) + n for field, n in counts.items()}
+        if last_vote is not None:
+            changes['last_vote'] = last_vote
+        if not cls.objects.filter(election_id=election_id).update(**changes):
+            cls.rebuild(election_id)
+
+    @classmethod
+    def rebuild(cls, election_id):
+        """Counts an election's tickets and votes again, for when they change other than by being issued or cast"""
+        election = Election.objects.get(id=election_id)
+        tickets = election.ticket_set.aggregate(issued=Count('id'), spent=Count('id', filter=Q(spent=True)))
+        votes = election.votes().aggregate(cast=Count('id'), last=Max('time'))
+        stats, _ = cls.objects.update_or_create(election=election, defaults={
+            'tickets_issued': tickets['issued'],
+            'tickets_spent': tickets['spent'],
+            'votes_cast': votes['cast'],
+            'last_vote': votes['last'],
+        })
+        return stats
+
+
+# Seconds a closed election's tally is cached for
+TALLY_TIMEOUT = 10 * 60
+
+
+def tally_cache_key(election_id):
+    return "votes:tally:" + str(election_id)
+
+
+@receiver(post_save, sender=Election)
+def election_changed(sender, instance, created, **kwargs):
+    cache.delete(tally_cache_key(instance.id))
+    if created:
+        ElectionStats.objects.create(election=instance)
+
+
+@receiver(post_save, sender=Candidate)
+@receiver(post_delete, sender=Candidate)
+@receiver(post_save, sender=FPTPVote)
+@receiver(post_delete, sender=FPTPVote)
+@receiver(post_save, sender=APRVVote)
+@receiver(post_delete, sender=APRVVote)
+@receiver(post_save, sender=STVVote)
+@receiver(post_delete, sender=STVVote)
+def tally_changed(sender, instance, **kwargs):
+    cache.delete(tally_cache_key(instance.election_id))
+
+
+@receiver(post_save, sender=STVPreference)
+@receiver(post_delete, sender=STVPreference)
+def preference_changed(sender, instance, **kwargs):
+    # preferences only know their election through their candidate, which may be going too
+    for election_id in Candidate.objects.filter(id=instance.candidate_id).values_list('election_id', flat=True):
+        cache.delete(tally_cache_key(election_id))
@@ -0,0 +1,87 @@
+from itertools import chain
+from typing import List, Tuple, Set
+
+from .stv import aggregate, numpy
+
+"""
+Pairwise (Condorcet) analysis of ranked ballots
+
+Builds the candidate x candidate matrix of how many voters ranked each candidate above each other,
+treating candidates left off a ballot as ranked equal last.
+Only distinct orderings are compared, all at once but in chunks so that memory stays bounded on huge electorates.
+Needs numpy, which requirements.txt installs; should it be missing the pairwise tab isn't shown.
+"""
+
+# distinct ballots compared at once, each needs candidates squared bytes of workspace
+CHUNK = 4096
+
+
+def available():
+    return numpy is not None
+
+
+class Pairwise:
+    def __init__(self, candidates: Set[int], votes: List[Tuple[int]]):
+        """Preferences for candidates not in candidates (say withdrawn ones) are skipped over"""
+        if numpy is None:
+            raise ImportError("Pairwise analysis needs numpy")
+        self.candidates = sorted(candidates)
+        n = len(self.candidates)
+
+        counts = aggregate(votes)
+        weights = numpy.fromiter(counts.values(), dtype=numpy.int64, count=len(counts))
+        lengths = numpy.fromiter(map(len, counts), dtype=numpy.int64, count=len(counts))
+        ids = numpy.fromiter(chain.from_iterable(counts), dtype=numpy.int64, count=lengths.sum())
+
+        # every preference as a ballot (row) and candidate (column), -1 for candidates not being compared
+        lookup = numpy.full(max(ids.max(initial=0), self.candidates[-1] if n else 0) + 1, -1)
+        lookup[self.candidates] = numpy.arange(n)
+        columns = lookup[ids]
+        rows = numpy.repeat(numpy.arange(len(counts)), lengths)
+        # the position of each preference among its ballot's compared preferences
+        kept = columns >= 0
+        seen = numpy.cumsum(kept)
+        before = numpy.concatenate(([0], seen))[lengths.cumsum() - lengths]
+        positions = seen - 1 - numpy.repeat(before, lengths)
+
+        # each ballot's rank for every candidate, unranked candidates sharing the rank after the last
+        ranks = numpy.full((len(counts), n), n, dtype=numpy.int16)
+        ranks[rows[kept], columns[kept]] = positions[kept]
+
+        self.matrix = numpy.zeros((n, n), dtype=numpy.int64)
+        for start in range(0, len(counts), CHUNK):
+            chunk = ranks[start:start + CHUNK]
+            above = chunk[:, :, None] < chunk[:, None, :]
+            self.matrix += numpy.tensordot(weights[start:start + CHUNK], above, axes=1)
+        self.strongest = self._strongest_paths()
+
+    def _strongest_paths(self):
+        """Schulze widest paths, by Floyd-Warshall with the inner loops vectorised"""
+        d = self.matrix
+        paths = numpy.where(d > d.T, d, 0)
+        for k in range(len(self.candidates)):
+            paths = numpy.maximum(paths, numpy.minimum(paths[:, k, None], paths[None, k, :]))
+        numpy.fill_diagonal(paths, 0)
+        return paths
+
+    def beats(self, i: int, j: int) -> bool:
+        """Whether more voters ranked the i-th candidate above the j-th than the other way round"""
+        return self.matrix[i, j] > self.matrix[j, i]
+
+    def condorcet_winner(self):
+        """The candidate who beats every other head to head, if there is one"""
+        n = len(self.candidates)
+        wins = (self.matrix > self.matrix.T).sum(axis=1)
+        winners = numpy.flatnonzero(wins == n - 1)
+        return self.candidates[winners[0]] if len(winners) else None
+
+    def schulze_ranking(self) -> List[Tuple[int, int]]:
+        """(candidate, number of others they beat by strongest path), best first"""
+        wins = (self.strongest > self.strongest.T).sum(axis=1)
+        order = sorted(range(len(self.candidates)), key=lambda i: (-wins[i], self.candidates[i]))
+        return [(self.candidates[i], int(wins[i])) for i in order]
+
+    def schulze_winners(self) -> List[int]:
+        """Candidates no one else beats by strongest path, one unless there's a tie"""
+        unbeaten = (self.strongest >= self.strongest.T).all(axis=1)
+        return [self.candidates[i] for i in numpy.flatnonzero(unbeaten)]
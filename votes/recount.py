@@ -0,0 +1,85 @@
+import random
+from collections import OrderedDict
+
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Election, Candidate
+from .stv import Election as StvCalculator, BallotSet, BallotTrie
+
+"""
+What-if STV recounts
+
+Loads a closed election's ballots once and runs variant counts (other seat numbers, other withdrawals) from them.
+The most recently asked for variants' counts are kept, so asking for one again costs nothing.
+"""
+
+# Elections whose ballots are held in memory, least recently used first
+MAX_ELECTIONS = 8
+# Counts kept for each of them, least recently used first
+MAX_VARIANTS = 32
+_recounts = OrderedDict()
+
+
+class Recount:
+    def __init__(self, election):
+        """election must be closed, as its ballots are only read once"""
+        if election.open:
+            raise ValueError("Only closed elections can be recounted")
+        self.election = election
+        self.ballots = BallotSet(election.candidate_set.values_list('id', flat=True), election.ballots())
+        self.withdrawn = frozenset(
+            election.candidate_set.filter(state=Candidate.State.WITHDRAWN).values_list('id', flat=True))
+        self.counts = OrderedDict()
+
+    def count(self, seats: int = None, withdrawn=None, seed: int = 0) -> StvCalculator:
+        """
+        Count with seats seats (by default the election's) and the given candidates withdrawn
+        (by default those withdrawn from the election), returning the finished calculator.
+        Tiebreaks are seeded so that asking for the same variant always gives the same answer.
+        Raises ValueError for candidates that aren't standing in the election, for callers to show as a form error.
+        """
+        seats = self.election.seats if seats is None else seats
+        withdrawn = self.withdrawn if withdrawn is None else frozenset(withdrawn)
+        unknown = withdrawn - self.ballots.candidates
+        if unknown:
+            raise ValueError(f"Candidates {sorted(unknown)} aren't in this election")
+        key = (seats, withdrawn, seed)
+        if key in self.counts:
+            self.counts.move_to_end(key)
+        else:
+            calc = StvCalculator(self.ballots.candidates, self.ballots, seats, backend=BallotTrie,
+                                 rng=random.Random(seed))
+            calc.withdraw(withdrawn)
+            calc.full_election()
+            self.counts[key] = calc
+            if len(self.counts) > MAX_VARIANTS:
+                self.counts.popitem(last=False)
+        return self.counts[key]
+
+
+def recount(election, seats: int = None, withdrawn=None, seed: int = 0) -> StvCalculator:
+    """Count a variant of a closed election, reusing its ballots and earlier counts if they're in memory"""
+    if election.id in _recounts:
+        _recounts.move_to_end(election.id)
+    else:
+        _recounts[election.id] = Recount(election)
+        if len(_recounts) > MAX_ELECTIONS:
+            _recounts.popitem(last=False)
+    return _recounts[election.id].count(seats, withdrawn, seed)
+
+
+def forget_recount(election_id):
+    _recounts.pop(election_id, None)
+
+
+@receiver(post_save, sender=Election)
+def election_changed(sender, instance, **kwargs):
+    # Reopening an election (or changing its seats) makes what's held stale,
+    # anything closing elections with update() has to call forget_recount itself
+    forget_recount(instance.id)
+
+
+@receiver(post_save, sender=Candidate)
+def candidate_changed(sender, instance, **kwargs):
+    forget_recount(instance.election_id)
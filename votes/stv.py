@@ -1,23 +1,39 @@
-import secrets
-from enum import Enum
-from fractions import Fraction
-from operator import itemgetter, attrgetter
-from typing import Dict, List, Tuple, Set
-
 """
 STV calculator
 
 Based on procedure as defined in https://prfound.org/resources/reference/reference-meek-rule/
 Uses exact ratio arithmetic to prevent need to use epsilon float comparisons.
+Fixed point decimal arithmetic (as in the reference rule) can be selected instead, which keeps numbers small on long counts.
+A numpy float backend is available for very large counts, it recounts exactly if any decision is too close to call.
 Uses a secure random generator to split ties randomly. 
 Unfortunately this is more likely to trigger than I'd prefer due to the small populations and single seats.
+Identical ballots are folded together and counted once per round with a multiplicity,
+so the cost of a round scales with the number of distinct orderings rather than the number of voters.
 """
 
+import secrets
+from collections import Counter
+from enum import Enum
+from fractions import Fraction
+from operator import itemgetter, attrgetter
+from typing import Dict, List, Tuple, Set
+
+try:
+    import numpy
+except ImportError:
+    # numpy is in requirements.txt, but only BallotMatrix needs it so the exact counts work without
+    numpy = None
+
 
 class ElectionError(RuntimeError):
     pass
 
 
+class AmbiguousCount(ArithmeticError):
+    """Raised when inexact arithmetic can't be trusted to make a decision"""
+    pass
+
+
 class States(Enum):
     HOPEFUL = 0
     WITHDRAWN = 1
@@ -32,11 +48,119 @@ class States(Enum):
         return "%s" % (self._name_)
 
 
+class ExactArithmetic:
+    """
+    Exact rational arithmetic (the default).
+    Numbers are Fractions, so nothing is ever rounded, but numerators and denominators grow with each B2f update.
+    """
+    # transfers are linear in the incoming weight, so they can be cached and rescaled
+    linear = True
+
+    def number(self, value: int) -> Fraction:
+        return Fraction(value)
+
+    def product(self, weight: Fraction, keep_factor: Fraction) -> Fraction:
+        return weight * keep_factor
+
+    def quota(self, total: Fraction, seats: int) -> Fraction:
+        return Fraction(total, seats + 1)
+
+    def keep_factor(self, keep_factor: Fraction, quota: Fraction, score: Fraction) -> Fraction:
+        return Fraction(keep_factor * quota, score)
+
+    def fraction(self, value: Fraction) -> Fraction:
+        return value
+
+    def equal(self, a: Fraction, b: Fraction) -> bool:
+        return a == b
+
+    def ambiguous(self, a: Fraction, b: Fraction) -> bool:
+        return False
+
+    def __str__(self):
+        return "exact"
+
+
+class FixedArithmetic:
+    """
+    Fixed point decimal arithmetic, rounded as described by the Meek reference rule.
+    Numbers are integers scaled by 10^digits.
+    Transfers (B2a) and keep factors (B2f) are rounded up, the quota (B2b) is truncated.
+    """
+    linear = False
+
+    def __init__(self, digits: int = 9):
+        self.digits = digits
+        self.scale = 10 ** digits
+
+    def number(self, value: int) -> int:
+        return value * self.scale
+
+    def product(self, weight: int, keep_factor: int) -> int:
+        return -(-weight * keep_factor // self.scale)
+
+    def quota(self, total: int, seats: int) -> int:
+        return total // (seats + 1)
+
+    def keep_factor(self, keep_factor: int, quota: int, score: int) -> int:
+        return -(-keep_factor * quota // score)
+
+    def fraction(self, value: int) -> Fraction:
+        return Fraction(value, self.scale)
+
+    def equal(self, a: int, b: int) -> bool:
+        return a == b
+
+    def ambiguous(self, a: int, b: int) -> bool:
+        # The rounding is part of the rule, so every comparison is decided by definition
+        return False
+
+    def __str__(self):
+        return f"fixed({self.digits})"
+
+
+class FloatArithmetic:
+    """
+    Floating point arithmetic.
+    Only an approximation of the exact count, so any comparison between two values that differ by less than
+    the tolerance is ambiguous, and the count has to be redone exactly.
+    """
+    linear = True
+
+    def __init__(self, tolerance: float = 1e-6):
+        self.tolerance = tolerance
+
+    def number(self, value: int) -> float:
+        return float(value)
+
+    def product(self, weight: float, keep_factor: float) -> float:
+        return weight * keep_factor
+
+    def quota(self, total: float, seats: int) -> float:
+        return total / (seats + 1)
+
+    def keep_factor(self, keep_factor: float, quota: float, score: float) -> float:
+        return keep_factor * quota / score
+
+    def fraction(self, value: float) -> Fraction:
+        return Fraction(value)
+
+    def equal(self, a: float, b: float) -> bool:
+        return abs(a - b) <= self.tolerance
+
+    def ambiguous(self, a: float, b: float) -> bool:
+        # Identical floats came from identical inputs (or exact integers), so they compare the same exactly
+        return a != b and abs(a - b) <= self.tolerance
+
+    def __str__(self):
+        return f"float({self.tolerance})"
+
+
 class Candidate:
-    def __init__(self, id_: int):
+    def __init__(self, id_: int, keep_factor=Fraction(1)):
         self.id = id_
         self.status = States.HOPEFUL
-        self.keep_factor: Fraction = Fraction(1)
+        self.keep_factor = keep_factor
 
     def __str__(self):
         return f"{self.id}: {self.status} ({str(self.keep_factor)})"
@@ -46,45 +170,354 @@ class Candidate:
 
 
 class Vote:
-    def __init__(self, candidates: Dict[int, Candidate], prefs: Tuple[int]):
+    def __init__(self, candidates: Dict[int, Candidate], prefs: Tuple[int], count: int = 1):
         self.prefs = tuple(map(candidates.get, prefs))
-
-    def check(self, candidates: Set[int]):
-        if len(self.prefs) != len(set(self.prefs)):
-            raise ElectionError(f'Double Vote [{self.prefs}]')
-        for i in self.prefs:
-            if i not in candidates:
-                raise ElectionError(f'Unknown Candidate [{self.prefs}]')
+        # number of identical ballots this vote stands for
+        self.count = count
 
     def __str__(self):
-        return '(' + (', '.join(map(lambda x: str(x.id_), self.prefs))) + ')'
+        return '(' + (', '.join(map(lambda x: str(x.id), self.prefs))) + ')'
 
     def __repr__(self):
-        return "Vote" + self.__str__()
+        return "Vote" + self.__str__() + ("" if self.count == 1 else " x" + str(self.count))
+
+
+def aggregate(votes: List[Tuple[int]]) -> Counter:
+    """Fold identical preference orderings into a mapping of ordering -> number of ballots"""
+    return Counter(map(tuple, votes))
+
+
+class BallotSet:
+    """
+    The checked, folded ballots of one election.
+    Immutable, so any number of counts (with different seats or withdrawals) can be run from one without
+    checking or folding the ballots again.
+    """
+    __slots__ = ('candidates', 'ballot_counts', 'total_votes')
+
+    def __init__(self, candidates: Set[int], votes: List[Tuple[int]]):
+        """votes can also be a Counter of ordering -> number of ballots, as aggregate() makes"""
+        self.candidates = frozenset(candidates)
+        counts = votes if isinstance(votes, Counter) else aggregate(votes)
+        for prefs in counts:
+            if len(prefs) != len(set(prefs)):
+                raise ElectionError(f'Double Vote [{prefs}]')
+            if not self.candidates.issuperset(prefs):
+                raise ElectionError(f'Unknown Candidate [{prefs}]')
+        # (ordering, number of ballots) pairs
+        self.ballot_counts = tuple(counts.items())
+        self.total_votes = sum(counts.values())
+
+    def __len__(self):
+        return len(self.ballot_counts)
+
+
+class BallotList:
+    """
+    Flat ballot store.
+    Every distinct ordering is walked in full on each round.
+    """
+    default_arithmetic = ExactArithmetic
+
+    def __init__(self, votes: List[Vote], arithmetic=ExactArithmetic()):
+        self.votes = votes
+        self.arithmetic = arithmetic
+
+    def score(self, candidates: Set[Candidate]) -> Tuple[Dict[Candidate, Fraction], Fraction]:
+        # B2a
+        arithmetic = self.arithmetic
+        wastage = arithmetic.number(0)
+        scores = {k: arithmetic.number(0) for k in candidates}
+        for vote in self.votes:
+            weight = arithmetic.number(1)
+            for candidate in vote.prefs:
+                delta = arithmetic.product(weight, candidate.keep_factor)
+                scores[candidate] += delta * vote.count
+                weight -= delta
+            wastage += weight * vote.count
+        return scores, wastage
+
+
+class BallotTrie:
+    """
+    Prefix tree ballot store.
+    Ballots sharing leading preferences share a path, so each prefix is evaluated once per round.
+    The transfer out of a subtree is linear in the weight arriving at it, so each node caches
+    what a unit weight arriving there hands to each candidate (and wastes).
+    That cache is reused until the keep factor of a candidate somewhere in the subtree changes.
+    Rounded arithmetic isn't linear, so then the tree is just walked top down without caching.
+    """
+    default_arithmetic = ExactArithmetic
+
+    class Node:
+        __slots__ = ('candidate', 'count', 'ending', 'children', 'members', 'cache', 'cached_at')
+
+        def __init__(self, candidate: Candidate = None):
+            self.candidate = candidate
+            # ballots passing through this node / ballots whose last preference is this node
+            self.count = 0
+            self.ending = 0
+            self.children: Dict[Candidate, 'BallotTrie.Node'] = {}
+            self.members: Set[Candidate] = set()
+            self.cache = None
+            self.cached_at = -1
+
+    def __init__(self, votes: List[Vote], arithmetic=ExactArithmetic()):
+        self.arithmetic = arithmetic
+        self.root = BallotTrie.Node()
+        for vote in votes:
+            node = self.root
+            node.count += vote.count
+            for candidate in vote.prefs:
+                if candidate not in node.children:
+                    node.children[candidate] = BallotTrie.Node(candidate)
+                node = node.children[candidate]
+                node.count += vote.count
+            node.ending += vote.count
+        self._members(self.root)
+        self.epoch = 0
+        self.keep_factors: Dict[Candidate, Fraction] = {}
+        self.changed_at: Dict[Candidate, int] = {}
+
+    def _members(self, node: 'BallotTrie.Node'):
+        # Iterative post-order so that long ballots can't hit the recursion limit
+        stack = [(node, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                for child in node.children.values():
+                    node.members |= child.members
+                if node.candidate is not None:
+                    node.members.add(node.candidate)
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children.values())
+
+    def _valid(self, node: 'BallotTrie.Node') -> bool:
+        # Changes are recorded at the start of a round, so a node cached in the same round already reflects them
+        return node.cache is not None and all(
+            self.changed_at[c] <= node.cached_at for c in node.members)
+
+    def _transfer(self, node: 'BallotTrie.Node'):
+        if self._valid(node):
+            return node.cache
+        keep_factor = node.candidate.keep_factor
+        remainder = self.arithmetic.number(1) - keep_factor
+        scores = {node.candidate: keep_factor * node.count}
+        wastage = remainder * node.ending
+        if remainder:
+            for child in node.children.values():
+                child_scores, child_wastage = self._transfer(child)
+                for candidate, value in child_scores.items():
+                    scores[candidate] = scores.get(candidate, 0) + remainder * value
+                wastage += remainder * child_wastage
+        node.cache = (scores, wastage)
+        node.cached_at = self.epoch
+        return node.cache
+
+    def _walk(self, candidates: Set[Candidate]):
+        arithmetic = self.arithmetic
+        wastage = arithmetic.number(self.root.ending)
+        scores = {k: arithmetic.number(0) for k in candidates}
+        stack = [(child, arithmetic.number(1)) for child in self.root.children.values()]
+        while stack:
+            node, weight = stack.pop()
+            delta = arithmetic.product(weight, node.candidate.keep_factor)
+            scores[node.candidate] += delta * node.count
+            weight -= delta
+            wastage += weight * node.ending
+            # once the weight is used up everything below here would be given nothing
+            if weight:
+                stack.extend((child, weight) for child in node.children.values())
+        return scores, wastage
+
+    def score(self, candidates: Set[Candidate]) -> Tuple[Dict[Candidate, Fraction], Fraction]:
+        # B2a
+        if not self.arithmetic.linear:
+            return self._walk(candidates)
+        self.epoch += 1
+        for candidate in candidates:
+            if self.keep_factors.get(candidate) != candidate.keep_factor:
+                self.keep_factors[candidate] = candidate.keep_factor
+                self.changed_at[candidate] = self.epoch
+
+        wastage = Fraction(self.root.ending)
+        scores = {k: Fraction(0) for k in candidates}
+        for child in self.root.children.values():
+            child_scores, child_wastage = self._transfer(child)
+            for candidate, value in child_scores.items():
+                scores[candidate] += value
+            wastage += child_wastage
+        return scores, wastage
+
+
+class BallotMatrix:
+    """
+    Vectorised ballot store (needs numpy).
+    Distinct orderings are packed into a padded matrix of candidate indices, so B2a is a handful of array
+    operations instead of a Python loop. Padding points at a dummy candidate whose keep factor is always 0.
+    Counts in floats, so should be used with FloatArithmetic.
+    """
+    default_arithmetic = FloatArithmetic
+
+    def __init__(self, votes: List[Vote], arithmetic=None):
+        if numpy is None:
+            raise ImportError("BallotMatrix requires numpy, install requirements.txt")
+        self.arithmetic = arithmetic or FloatArithmetic()
+        self.index: Dict[Candidate, int] = {}
+        for vote in votes:
+            for candidate in vote.prefs:
+                self.index.setdefault(candidate, len(self.index))
+        padding = len(self.index)
+        width = max((len(vote.prefs) for vote in votes), default=0) or 1
+        self.prefs = numpy.full((len(votes), width), padding, dtype=numpy.intp)
+        for row, vote in enumerate(votes):
+            self.prefs[row, :len(vote.prefs)] = [self.index[c] for c in vote.prefs]
+        self.counts = numpy.array([vote.count for vote in votes], dtype=numpy.float64)
+        self.keep_factors = numpy.zeros(padding + 1)
+
+    def score(self, candidates: Set[Candidate]) -> Tuple[Dict[Candidate, float], float]:
+        # B2a
+        for candidate, i in self.index.items():
+            self.keep_factors[i] = candidate.keep_factor
+        keep = self.keep_factors[self.prefs]
+        # weight remaining after each preference, and so the weight arriving at each preference
+        remaining = numpy.cumprod(1 - keep, axis=1)
+        arriving = numpy.ones_like(remaining)
+        arriving[:, 1:] = remaining[:, :-1]
+        transfers = arriving * keep * self.counts[:, None]
+        totals = numpy.bincount(self.prefs.ravel(), weights=transfers.ravel(),
+                                minlength=len(self.keep_factors))
+        scores = {k: 0.0 for k in candidates}
+        for candidate, i in self.index.items():
+            scores[candidate] = float(totals[i])
+        return scores, float(remaining[:, -1] @ self.counts)
+
+
+class RoundLog:
+    """
+    What happened during a count, recorded as the numbers the count used.
+    Nothing is formatted until the log is read, by records() (plain, JSON serialisable)
+    or lines() (the text the calculator used to print), which can also render stored records.
+    """
+
+    def __init__(self, arithmetic):
+        self.arithmetic = arithmetic
+        self.entries = []
+
+    def round(self, number: int, quota, wastage, candidates, scores):
+        self.entries.append(('round', number, quota, wastage,
+                             tuple((c.id, c.status, c.keep_factor, scores[c]) for c in candidates)))
+
+    def tiebreak(self, candidate: Candidate):
+        self.entries.append(('tiebreak', candidate.id, candidate.status, candidate.keep_factor))
+
+    def result(self, candidates):
+        self.entries.append(('result', tuple((c.id, c.status) for c in candidates)))
+
+    def _number(self, value, exact=False) -> str:
+        value = self.arithmetic.fraction(value)
+        return str(value if exact else value.limit_denominator(1000))
+
+    def records(self) -> List[dict]:
+        records = []
+        for entry in self.entries:
+            if entry[0] == 'round':
+                _, number, quota, wastage, candidates = entry
+                records.append({
+                    'type': 'round',
+                    'round': number,
+                    'quota': self._number(quota),
+                    'wastage': self._number(wastage),
+                    'candidates': [
+                        {'id': id_, 'status': str(status), 'keep_factor': self._number(keep_factor),
+                         'votes': self._number(score)}
+                        for id_, status, keep_factor, score in candidates],
+                })
+            elif entry[0] == 'tiebreak':
+                _, id_, status, keep_factor = entry
+                records.append({'type': 'tiebreak', 'id': id_, 'status': str(status),
+                                'keep_factor': self._number(keep_factor, exact=True)})
+            else:
+                records.append({'type': 'result', **{
+                    str(state).lower(): [id_ for id_, status in entry[1] if status == state]
+                    for state in (States.ELECTED, States.DEFEATED, States.WITHDRAWN)}})
+        return records
+
+    def lines(self) -> List[str]:
+        return self.render(self.records())
+
+    @staticmethod
+    def render(records: List[dict]) -> List[str]:
+        """Text lines for records"""
+        lines = []
+        for record in records:
+            if record['type'] == 'round':
+                lines += [str(record['round']), "======"]
+                for candidate in record['candidates']:
+                    lines += [f"Candidate: {candidate['id']} {candidate['keep_factor']}",
+                              f"Status: {candidate['status']}",
+                              f"Votes: {candidate['votes']}",
+                              ""]
+                lines += [f"Wastage: {record['wastage']}", ""]
+            elif record['type'] == 'tiebreak':
+                lines += ["-Tiebreak-", f"{record['id']}: {record['status']} ({record['keep_factor']})", ""]
+            else:
+                lines += ["**Election Results**", ""]
+                for state in ('ELECTED', 'DEFEATED', 'WITHDRAWN'):
+                    lines.append(state)
+                    lines += [f" Candidate {id_}" for id_ in record[state.lower()]]
+                lines.append("")
+        return lines
 
 
 class Election:
-    def __init__(self, candidates: Set[int], votes: List[Tuple[int]], seats: int):
-        self.candidatedict = {i: Candidate(i) for i in candidates}
-        self.candidates = set(self.candidatedict.values())
-        self.votes = [Vote(self.candidatedict, i) for i in votes]
+    def __init__(self, candidates: Set[int], votes: List[Tuple[int]], seats: int, backend: type = BallotList,
+                 arithmetic=None, rng=None, log: bool = True):
+        """
+        backend selects the ballot store used for counting (BallotList, BallotTrie or BallotMatrix).
+        arithmetic selects the number representation, by default whatever the backend suits
+        (ExactArithmetic, or FloatArithmetic for BallotMatrix). FixedArithmetic can be chosen for the others.
+        If inexact arithmetic hits a decision it can't make reliably, the count is restarted exactly.
+        rng is the random source for tiebreaks, a secure one is used if not given.
+        votes may be a BallotSet for these candidates, which saves checking the ballots again.
+        log records each round in a RoundLog, counts that only need the winners can turn it off.
+        """
+        self.random = rng or secrets.SystemRandom()
+        self.candidate_ids = set(candidates)
+        ballots = votes if isinstance(votes, BallotSet) else BallotSet(candidates, votes)
+        self.ballot_counts = ballots.ballot_counts
+        self.total_votes = ballots.total_votes
         self.seats = seats
+        self.withdrawn = set()
+        self.logging = log
+        self._setup(backend, arithmetic or backend.default_arithmetic())
+
+    def _setup(self, backend: type, arithmetic):
+        self.arithmetic = arithmetic
+        self.candidatedict = {i: Candidate(i, self.arithmetic.number(1)) for i in self.candidate_ids}
+        self.candidates = set(self.candidatedict.values())
+        self.votes = [Vote(self.candidatedict, prefs, count)
+                      for prefs, count in self.ballot_counts]
         self.rounds = 0
-        self.fulllog = []
-        print(candidates, votes, seats)
+        self.log = RoundLog(self.arithmetic) if self.logging else None
         # Huge initial value
         # (surplus should never be this high in our situation (its more votes than there are people in the world))
         # If this code is still used when population is this high,
         # why the fuck haven't you moved this to a faster language??????
-        self.previous_surplus = Fraction(10000000000000000000000000, 1)
-        for i in self.votes:
-            i.check(self.candidates)
+        self.previous_surplus = self.arithmetic.number(10000000000000000000000000)
+        self.ballots = backend(self.votes, self.arithmetic)
+        self.withdraw(self.withdrawn)
+
+    def _recount_exactly(self):
+        self._setup(BallotTrie, ExactArithmetic())
 
     def withdraw(self, candidates: Set[int]):
+        self.withdrawn |= set(candidates)
         candidates = [self.candidatedict[cand] for cand in candidates]
         for i in candidates:
             i.status = States.WITHDRAWN
-            i.keep_factor = Fraction(0)
+            i.keep_factor = self.arithmetic.number(0)
 
     def round(self):
         self.rounds += 1
@@ -96,35 +529,30 @@ class Election:
         if len(electable) <= self.seats:
             for i in electable:
                 i.status = States.ELECTED
-            self._report()
+            if self.log:
+                self.log.result(self.candidates)
             raise StopIteration('Election Finished')
 
         # B2a
-        wastage = Fraction(0)
-        scores = {k: Fraction(0) for k in self.candidates}
-        for vote in self.votes:
-            weight: Fraction = Fraction(1)
-            for candidate in vote.prefs:
-                delta: Fraction = weight * candidate.keep_factor
-                scores[candidate] += delta
-                weight -= delta
-            wastage += weight
+        scores, wastage = self.ballots.score(self.candidates)
 
         # Check all votes accounted for
-        assert wastage + sum(scores.values()) == len(self.votes)
+        assert self.arithmetic.equal(wastage + sum(scores.values()), self.arithmetic.number(self.total_votes))
 
         # B2b
-        quota = Fraction(sum(scores.values()), self.seats + 1)
+        quota = self.arithmetic.quota(sum(scores.values()), self.seats)
 
         # B2c
         elected = False
         for candidate in self.candidates:
-            if candidate.status == States.HOPEFUL and scores[candidate] > quota:
-                candidate.status = States.ELECTED
-                elected = True
+            if candidate.status == States.HOPEFUL:
+                self._check(scores[candidate], quota)
+                if scores[candidate] > quota:
+                    candidate.status = States.ELECTED
+                    elected = True
 
         # B2d
-        surplus = Fraction(0)
+        surplus = self.arithmetic.number(0)
         for candidate in self.candidates:
             if candidate.status == States.ELECTED:
                 surplus += scores[candidate] - quota
@@ -132,145 +560,162 @@ class Election:
         # B2e
         if elected:
             self.previous_surplus = surplus
-            self._log(scores, wastage)
+            if self.log:
+                self.log.round(self.rounds, quota, wastage, self.candidates, scores)
             return
 
+        self._check(surplus, self.arithmetic.number(0))
+        self._check(surplus, self.previous_surplus)
         if surplus == 0 or surplus >= self.previous_surplus:
             # B3
             sorted_results = sorted(filter(
                 lambda x: x[0].status == States.HOPEFUL, scores.items()), key=itemgetter(1))
             min_score = sorted_results[0][1]
+            for _, score in sorted_results[1:]:
+                self._check(score, min_score + surplus)
             eliminated_candidate: Candidate = self._choose(
                 list(filter(lambda x: x[1] <= min_score + surplus, sorted_results)))
             eliminated_candidate.status = States.DEFEATED
-            eliminated_candidate.keep_factor = Fraction(0)
+            eliminated_candidate.keep_factor = self.arithmetic.number(0)
         else:
             # B2f
             for candidate in self.candidates:
                 if candidate.status == States.ELECTED:
-                    candidate.keep_factor = Fraction(
-                        candidate.keep_factor * quota, scores[candidate])
+                    candidate.keep_factor = self.arithmetic.keep_factor(
+                        candidate.keep_factor, quota, scores[candidate])
         self.previous_surplus = surplus
-        self._log(scores, wastage)
+        if self.log:
+            self.log.round(self.rounds, quota, wastage, self.candidates, scores)
+
+    def _check(self, a, b):
+        if self.arithmetic.ambiguous(a, b):
+            raise AmbiguousCount(f"Can't reliably compare {a} and {b} with {self.arithmetic} arithmetic")
 
     def _choose(self, candidates):
         if len(candidates) > 1:
-            a = secrets.choice(candidates)[0]
-            self._addlog("-Tiebreak-")
-            self._addlog(a)
-            self._addlog()
+            # Sorted so that a seeded rng makes the same choice whatever order the set iterated in
+            a = self.random.choice(sorted(candidates, key=lambda x: x[0].id))[0]
+            if self.log:
+                self.log.tiebreak(a)
         else:
             a = candidates[0][0]
         return a
 
-    def _addlog(self, *args):
-        string = " ".join(map(str, args))
-        self.fulllog.append(string)
-        print(string)
-
-    def _log(self, scores, wastage):
-        self._addlog(self.rounds)
-        self._addlog("======")
-        for i in self.candidates:
-            assert isinstance(i, Candidate)
-            self._addlog("Candidate:", i.id,
-                         i.keep_factor.limit_denominator(1000))
-            self._addlog("Status:", str(i.status))
-            self._addlog("Votes:", str(scores[i].limit_denominator(1000)))
-            self._addlog()
-        self._addlog("Wastage:", str(wastage.limit_denominator(1000)))
-        self._addlog()
-
-    def _report(self):
-        self._addlog("**Election Results**")
-        self._addlog()
-        self._addlog("ELECTED")
-        for i in filter(lambda x: x.status == States.ELECTED, self.candidates):
-            self._addlog(" Candidate", i.id)
-        self._addlog("DEFEATED")
-        for i in filter(lambda x: x.status == States.DEFEATED, self.candidates):
-            self._addlog(" Candidate", i.id)
-        self._addlog("WITHDRAWN")
-        for i in filter(lambda x: x.status == States.WITHDRAWN, self.candidates):
-            self._addlog(" Candidate", i.id)
-        self._addlog()
-
-    def full_election(self):
+    @property
+    def fulllog(self) -> List[str]:
+        return self.log.lines() if self.log else []
+
+    def full_election(self, after_round=None):
+        """Counts until every seat is filled, calling after_round (if given) with no arguments after each round"""
         try:
             while True:
                 self.round()
+                if after_round is not None:
+                    after_round()
         except StopIteration:
             pass
+        except AmbiguousCount:
+            self._recount_exactly()
+            self.full_election(after_round)
 
     def winners(self):
         return map(attrgetter('id'), filter(lambda x: x.status == States.ELECTED, self.candidates))
 
 
-def fptp_equivalent():
+def fptp_equivalent(**kwargs):
     c = {1, 2}
     v = [(1, 2)] * 9 + [(2, 1)] * 8 + [(2,)] + [(1,)]
-    e = Election(c, v, 1)
+    e = Election(c, v, 1, **kwargs)
     e.full_election()
+    return e
 
 
-def immediate_majority():
+def immediate_majority(**kwargs):
     c = {1, 2, 3, 4}
     v = [(1, 2, 3, 4)] * 9 + [(2, 3, 1, 4)] * \
         4 + [(3, 1, 4, 2)] * 3 + [(4, 1)] * 2
-    e = Election(c, v, 1)
+    e = Election(c, v, 1, **kwargs)
     e.full_election()
+    return e
 
 
-def delayed_majority():
+def delayed_majority(**kwargs):
     c = {1, 2, 3, 4}
     v = [(4, 2, 1, 3)] * 4 + [(3, 2, 4, 1)] * 4 + [(2, 4, 1, 3)]
-    e = Election(c, v, 1)
+    e = Election(c, v, 1, **kwargs)
     e.full_election()
+    return e
 
 
-def delayeder_majority():
+def delayeder_majority(**kwargs):
     c = {1, 2, 3, 4}
     v = [(4, 2, 1, 3)] * 4 + [(3, 2, 4, 1)] * \
         5 + [(2, 1, 4, 3)] + [(1, 4, 2, 3)]
-    e = Election(c, v, 1)
+    e = Election(c, v, 1, **kwargs)
     e.full_election()
+    return e
 
 
-def two_available_three():
+def two_available_three(**kwargs):
     c = {1, 2, 3}
     v = [(1, 2, 3), (1, 3, 2), (2,), (3, 1), (3, 1), (1, 2, 3), (2,), (1, 3, 2), (1, 3, 2), (1, 3, 2), (1, 3, 2),
          (1, 3, 2), ]
-    e = Election(c, v, 2)
+    e = Election(c, v, 2, **kwargs)
     e.full_election()
+    return e
 
 
-def two_available_four():
+def two_available_four(**kwargs):
     c = {1, 2, 3, 4}
     v = [(4, 2, 1, 3)] * 4 + [(3, 2, 4, 1)] * 5 + \
         [(2, 1, 4, 3)] * 3 + [(1, 4, 2, 3)] * 2
-    e = Election(c, v, 2)
+    e = Election(c, v, 2, **kwargs)
     e.full_election()
+    return e
 
 
-def tiebreaker():
+def tiebreaker(**kwargs):
     c = {1, 2, 3, 4}
     v = [(1,), (2,), (3,), (4,)]
-    e = Election(c, v, 1)
+    e = Election(c, v, 1, **kwargs)
     e.full_election()
+    return e
 
 
-def malformed():
+def malformed(**kwargs):
     c = {1, 2}
     v = [(1, 2, 1)] * 10
-    e = Election(c, v, 1)
+    e = Election(c, v, 1, **kwargs)
     e.full_election()
+    return e
 
 
-def malformed2():
+def malformed2(**kwargs):
     c = {1, 2, 3}
     v = [(1, 2, 3, 4)] * 10
-    e = Election(c, v, 1)
+    e = Election(c, v, 1, **kwargs)
     e.full_election()
+    return e
+
+
+SCENARIOS = [fptp_equivalent, immediate_majority, delayed_majority, delayeder_majority,
+             two_available_three, two_available_four, tiebreaker]
+
+
+def cross_check(digits: int = 9, seed: int = 0, scenarios=SCENARIOS):
+    """
+    Run each scenario with exact and fixed point arithmetic, to compare the winners.
+    Both counts use the same seeded tiebreaks, so only arithmetic can make them differ.
+    Returns a list of (scenario name, exact winners, fixed winners), one per scenario.
+    """
+    import random
+
+    results = []
+    for scenario in scenarios:
+        exact = set(scenario(arithmetic=ExactArithmetic(), rng=random.Random(seed)).winners())
+        fixed = set(scenario(arithmetic=FixedArithmetic(digits), rng=random.Random(seed)).winners())
+        results.append((scenario.__name__, exact, fixed))
+    return results
 
 
 if __name__ == '__main__':
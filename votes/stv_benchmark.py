@@ -0,0 +1,145 @@
+import itertools
+import random
+import time
+import tracemalloc
+from typing import List, Tuple
+
+from .stv import Election, BallotList, BallotTrie, BallotMatrix, FixedArithmetic
+
+"""
+STV benchmark suite
+
+Generates synthetic elections from seeded distributions and times the calculator on them.
+Every run is reported as a flat dict, so results can be dumped as JSON lines and compared between versions.
+"""
+
+# name -> (ballot store, arithmetic factory)
+ENGINES = {
+    'list': (BallotList, None),
+    'trie': (BallotTrie, None),
+    'fixed': (BallotTrie, FixedArithmetic),
+    'matrix': (BallotMatrix, None),
+}
+
+
+def random_votes(rng: random.Random, voters: int, candidates: int) -> List[Tuple[int]]:
+    """Independent uniformly random orderings, truncated at a random length"""
+    votes = []
+    for _ in range(voters):
+        prefs = list(range(1, candidates + 1))
+        rng.shuffle(prefs)
+        votes.append(tuple(prefs[:rng.randint(1, candidates)]))
+    return votes
+
+
+def clustered_votes(rng: random.Random, voters: int, candidates: int, clusters: int = 3,
+                    noise: float = 0.2) -> List[Tuple[int]]:
+    """A few factions with a shared ordering each, every voter swapping neighbouring preferences now and then"""
+    factions = []
+    for _ in range(clusters):
+        prefs = list(range(1, candidates + 1))
+        rng.shuffle(prefs)
+        factions.append(prefs)
+    votes = []
+    for _ in range(voters):
+        prefs = list(rng.choice(factions))
+        for i in range(len(prefs) - 1):
+            if rng.random() < noise:
+                prefs[i], prefs[i + 1] = prefs[i + 1], prefs[i]
+        votes.append(tuple(prefs[:rng.randint(1, candidates)]))
+    return votes
+
+
+def adversarial_votes(rng: random.Random, voters: int, candidates: int) -> List[Tuple[int]]:
+    """
+    Cyclic orderings with near equal first preferences.
+    Every exclusion is close, transfers run through long chains and keep factors take many rounds to settle.
+    """
+    votes = []
+    for i in range(voters):
+        start = i % candidates
+        prefs = [(start + j) % candidates + 1 for j in range(candidates)]
+        # reverse half of the chains so that no candidate is everyone's second choice
+        if rng.random() < 0.5:
+            prefs = prefs[:1] + prefs[:0:-1]
+        votes.append(tuple(prefs))
+    return votes
+
+
+DISTRIBUTIONS = {
+    'random': random_votes,
+    'clustered': clustered_votes,
+    'adversarial': adversarial_votes,
+}
+
+
+class MeasuredElection(Election):
+    """Election that records the size of the largest denominator it has had to handle"""
+
+    def __init__(self, *args, **kwargs):
+        self.denominator_bits = 0
+        super().__init__(*args, **kwargs)
+
+    def _measure(self, value):
+        denominator = self.arithmetic.fraction(value).denominator
+        self.denominator_bits = max(self.denominator_bits, denominator.bit_length())
+
+    def round(self):
+        try:
+            super().round()
+        finally:
+            for candidate in self.candidates:
+                self._measure(candidate.keep_factor)
+            self._measure(self.previous_surplus)
+
+
+def count(votes, candidates: int, seats: int, engine: str, seed: int) -> MeasuredElection:
+    backend, arithmetic = ENGINES[engine]
+    election = MeasuredElection(set(range(1, candidates + 1)), votes, seats, backend=backend,
+                                arithmetic=arithmetic and arithmetic(), rng=random.Random(seed))
+    election.full_election()
+    return election
+
+
+def run(distribution: str, voters: int, candidates: int, seats: int, engine: str = 'trie', seed: int = 0,
+        memory: bool = True) -> dict:
+    """
+    Count one synthetic election and report on it.
+    Tracing allocations slows the count down a lot, so peak memory comes from a second, traced, count.
+    """
+    votes = DISTRIBUTIONS[distribution](random.Random(seed), voters, candidates)
+
+    start = time.perf_counter()
+    election = count(votes, candidates, seats, engine, seed)
+    wall_time = time.perf_counter() - start
+
+    peak_memory = None
+    if memory:
+        tracemalloc.start()
+        count(votes, candidates, seats, engine, seed)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'distribution': distribution,
+        'voters': voters,
+        'candidates': candidates,
+        'seats': seats,
+        'engine': engine,
+        'arithmetic': str(election.arithmetic),
+        'seed': seed,
+        'distinct_ballots': len(election.votes),
+        'wall_time': wall_time,
+        'rounds': election.rounds,
+        'peak_memory': peak_memory,
+        'denominator_bits': election.denominator_bits,
+        'winners': sorted(election.winners()),
+    }
+
+
+def sweep(voters=(100, 1000, 10000), candidates=(4, 8, 12), seats=(1, 3), distributions=tuple(DISTRIBUTIONS),
+          engines=('trie',), seed: int = 0, memory: bool = True):
+    """Yields a result for every combination of the parameters that makes a contested election"""
+    for distribution, v, c, s, engine in itertools.product(distributions, voters, candidates, seats, engines):
+        if s < c:
+            yield run(distribution, v, c, s, engine, seed, memory)
@@ -0,0 +1,95 @@
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import List, Set, Tuple
+
+from .stv import Election, BallotTrie
+
+"""
+STV tiebreak analysis
+
+Ties are broken at random, and with our electorates they're common enough to decide seats.
+Rerunning the count under many seeded tiebreaks shows how often each candidate would have won,
+and from which round the counts stopped agreeing. Reruns are spread over a process pool in chunks of seeds,
+so the ballots are sent to a worker once per chunk rather than once per rerun.
+"""
+
+
+class TracedElection(Election):
+    """Election that records the round and outcome of every tiebreak it makes"""
+
+    def _setup(self, *args, **kwargs):
+        self.tiebreaks = []
+        super()._setup(*args, **kwargs)
+
+    def _choose(self, candidates):
+        chosen = super()._choose(candidates)
+        if len(candidates) > 1:
+            self.tiebreaks.append((self.rounds, chosen.id))
+        return chosen
+
+
+# Chunks of seeds handed to the pool
+CHUNKS = 64
+
+
+def _rerun(election: tuple, seed: int) -> Tuple[Tuple[int], List[Tuple[int, int]]]:
+    candidates, votes, seats, withdrawn, backend = election
+    election = TracedElection(candidates, votes, seats, backend=backend, rng=random.Random(seed), log=False)
+    election.withdraw(withdrawn)
+    election.full_election()
+    return tuple(sorted(election.winners())), election.tiebreaks
+
+
+def _rerun_chunk(election: tuple, seeds: range):
+    return [_rerun(election, seed) for seed in seeds]
+
+
+def _divergence(tiebreaks: List[List[Tuple[int, int]]]):
+    """The first round in which some rerun broke a tie differently to another, or None if they all agree"""
+    first = None
+    for choices in zip(*tiebreaks):
+        # every rerun is the same until a tie goes differently, so they all reach this tiebreak in the same round
+        if len(set(choices)) > 1:
+            first = choices[0][0]
+            break
+    else:
+        # reruns that ran out of tiebreaks at different points differ at the first one they don't share
+        lengths = set(map(len, tiebreaks))
+        if len(lengths) > 1:
+            shortest = min(lengths)
+            first = min(run[shortest][0] for run in tiebreaks if len(run) > shortest)
+    return first
+
+
+def analyse(candidates: Set[int], votes: List[Tuple[int]], seats: int, withdrawn: Set[int] = frozenset(),
+            runs: int = 1000, seed: int = 0, workers: int = None, backend: type = BallotTrie) -> dict:
+    """
+    Count an election under runs different tiebreak seeds (seed, seed + 1, ...).
+    workers is the size of the process pool, by default one per CPU. With one worker everything runs here.
+    Returns how often each candidate won, how often each set of winners came up,
+    the number of reruns that needed a tiebreak and the round at which reruns first diverged (None if never).
+    """
+    election = (set(candidates), list(votes), seats, set(withdrawn), backend)
+    seeds = range(seed, seed + runs)
+    if workers == 1:
+        results = _rerun_chunk(election, seeds)
+    else:
+        size = max(1, runs // CHUNKS)
+        chunks = [seeds[start:start + size] for start in range(0, runs, size)]
+        with ProcessPoolExecutor(workers) as pool:
+            results = [result for chunk in pool.map(partial(_rerun_chunk, election), chunks) for result in chunk]
+
+    outcomes = Counter(winners for winners, _ in results)
+    wins = Counter({candidate: 0 for candidate in election[0]})
+    for winners, times in outcomes.items():
+        wins.update(dict.fromkeys(winners, times))
+    tiebreaks = [tiebreaks for _, tiebreaks in results]
+    return {
+        'runs': runs,
+        'wins': dict(wins),
+        'outcomes': dict(outcomes),
+        'tied_runs': sum(1 for run in tiebreaks if run),
+        'diverges_at': _divergence(tiebreaks),
+    }
@@ -0,0 +1,107 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Election, Candidate, STVResult
+from .stv import Election as StvCalculator
+
+logger = logging.getLogger(__name__)
+
+# Counts run one at a time in the background of whichever process asked for them,
+# so a web request never has to wait for one
+executor = ThreadPoolExecutor(max_workers=1)
+
+# How often a running count renews its claim, well inside STVResult.STALE_AFTER
+HEARTBEAT = timedelta(minutes=1)
+
+
+class ClaimLost(RuntimeError):
+    """Another worker took over a count, which the original worker then abandons"""
+    pass
+
+
+def tally(election, after_round=None):
+    """Run the STV count for an election, returning the finished calculator"""
+    candidates = set(
+        election.candidate_set.values_list('id', flat=True))
+    withdrawn = set(
+        election.candidate_set.filter(
+            state=Candidate.State.WITHDRAWN).values_list('id', flat=True))
+
+    calc = StvCalculator(candidates, election.ballots(), election.seats)
+    calc.withdraw(withdrawn)
+    calc.full_election(after_round)
+    return calc
+
+
+def count_stv(election_id, force=False):
+    """
+    Count an election and store the outcome in its STVResult.
+    Whoever moves the result from pending (or a running count that has gone stale) to running does the count,
+    anyone else returns None straight away.
+    force takes the count over whatever state the result is in.
+    The claim is renewed as the count goes, and a worker whose claim has been taken over stops and returns None.
+    """
+    claim = STVResult.objects.filter(election_id=election_id)
+    if not force:
+        claim = claim.filter(STVResult.claimable())
+    claimed = timezone.now()
+    if not claim.update(status=STVResult.Status.RUNNING, started=claimed):
+        return None
+    ours = STVResult.objects.filter(election_id=election_id, status=STVResult.Status.RUNNING)
+
+    def heartbeat():
+        nonlocal claimed
+        now = timezone.now()
+        if now - claimed >= HEARTBEAT:
+            if not ours.filter(started=claimed).update(started=now):
+                raise ClaimLost(election_id)
+            claimed = now
+
+    result = STVResult.objects.select_related('election').get(election_id=election_id)
+    try:
+        calc = tally(result.election, heartbeat)
+    except ClaimLost:
+        return None
+    except Exception:
+        ours.filter(started=claimed).update(status=STVResult.Status.FAILED)
+        raise
+    with transaction.atomic():
+        if not ours.select_for_update().filter(started=claimed).exists():
+            return None
+        # Stored as records, only turned into text when someone reads it
+        result.log = calc.log.records()
+        result.full_log = ""
+        result.status = STVResult.Status.DONE
+        result.started = claimed
+        result.generated = timezone.now()
+        result.save()
+        result.winners.set(calc.winners())
+    return result
+
+
+def _background_count(election_id):
+    try:
+        count_stv(election_id)
+    except Exception:
+        # Nothing reads the future, so this is the only record of why the count failed
+        logger.exception("Counting election %s failed", election_id)
+    finally:
+        # Each worker thread has its own connection, which nothing else will close
+        connection.close()
+
+
+def enqueue_stv_count(election):
+    """
+    Get the (single) result for an election, queueing the count if it hasn't been done yet.
+    Creating the result row is what stops two requests both counting.
+    A count whose process died is queued again once it's stale.
+    """
+    result, created = STVResult.objects.get_or_create(
+        election=election, defaults={'status': STVResult.Status.PENDING})
+    if result.status == STVResult.Status.PENDING or result.stalled:
+        transaction.on_commit(lambda: executor.submit(_background_count, election.id))
+    return result
@@ -1,3 +1,569 @@
-from django.test import TestCase
+import io
+import json
+import random
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from fractions import Fraction
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command, CommandError
+from django.db import connection, OperationalError
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from users.models import Member
+
+from . import stv, stv_benchmark, stv_tiebreaks, blt, pairwise, tasks, recount as recount_module
+from .models import Election, Candidate, STVVote, STVPreference, STVResult, FPTPVote, Ticket, \
+    ElectionStats
+from .ballots import cast_stv, AlreadyVoted
+from .recount import recount
+from .tasks import count_stv, enqueue_stv_count
+from .tickets import issue_tickets
+from .templatetags.vote_tags import sanitized_vote_count
+from .stv import Election as StvCalculator, BallotSet, BallotList, BallotTrie, BallotMatrix, FixedArithmetic, \
+    FloatArithmetic, ExactArithmetic, cross_check
+
+
+def synthetic_votes(seed, voters=200, candidates=5):
+    # Seeds used below are known to be decided without any random tiebreak
+    rng = random.Random(seed)
+    votes = []
+    for _ in range(voters):
+        prefs = list(range(1, candidates + 1))
+        rng.shuffle(prefs)
+        votes.append(tuple(prefs[:rng.randint(1, candidates)]))
+    return votes
+
+
+class StvAggregation(TestCase):
+    def test_identical_ballots_folded(self):
+        votes = [(4, 2, 1, 3)] * 4 + [(3, 2, 4, 1)] * 5 + \
+                [(2, 1, 4, 3)] * 3 + [(1, 4, 2, 3)] * 2
+        calc = StvCalculator({1, 2, 3, 4}, votes, 2)
+        self.assertEqual(len(calc.votes), 4)
+        self.assertEqual(calc.total_votes, len(votes))
+
+    def test_folded_winners(self):
+        votes = [(4, 2, 1, 3)] * 4 + [(3, 2, 4, 1)] * 4 + [(2, 4, 1, 3)]
+        calc = StvCalculator({1, 2, 3, 4}, votes, 1)
+        calc.full_election()
+        self.assertEqual(set(calc.winners()), {4})
+
+
+class StvTrie(TestCase):
+    votes = [(4, 2, 1, 3)] * 4 + [(3, 2, 4, 1)] * 5 + [(2, 1, 4, 3)] * 3 + \
+            [(1, 4, 2, 3)] * 2 + [(4, 2)] + [(4,)] + [()]
+
+    def test_matches_flat_count(self):
+        votes = synthetic_votes(1)
+        flat = StvCalculator({1, 2, 3, 4, 5}, votes, 2, backend=BallotList)
+        trie = StvCalculator({1, 2, 3, 4, 5}, votes, 2, backend=BallotTrie)
+        flat.full_election()
+        trie.full_election()
+        self.assertEqual(sorted(flat.fulllog), sorted(trie.fulllog))
+        self.assertEqual(set(flat.winners()), set(trie.winners()))
+
+    def test_cached_transfers_follow_keep_factors(self):
+        calc = StvCalculator({1, 2, 3, 4}, self.votes, 2, backend=BallotTrie)
+        flat = BallotList(calc.votes)
+        for keep in [1, 0.5, 0.25, 0.25, 0]:
+            calc.candidatedict[4].keep_factor = Fraction(keep)
+            self.assertEqual(calc.ballots.score(calc.candidates),
+                             flat.score(calc.candidates))
+
+    def test_unchanged_subtrees_reused(self):
+        calc = StvCalculator({1, 2, 3, 4}, self.votes, 2, backend=BallotTrie)
+        calc.candidatedict[4].keep_factor = Fraction(1, 2)
+        calc.ballots.score(calc.candidates)
+        cached = {candidate: node.cache for candidate, node in calc.ballots.root.children.items()}
+        calc.ballots.score(calc.candidates)
+        for candidate, node in calc.ballots.root.children.items():
+            self.assertIs(node.cache, cached[candidate])
+
+
+class StvArithmetic(TestCase):
+    def test_fixed_point_agrees_on_scenarios(self):
+        for name, exact, fixed in cross_check(digits=9):
+            with self.subTest(scenario=name):
+                self.assertEqual(exact, fixed)
+
+    def test_fixed_point_stays_integral(self):
+        calc = StvCalculator({1, 2, 3, 4, 5}, synthetic_votes(1), 2,
+                             arithmetic=FixedArithmetic(6))
+        calc.full_election()
+        self.assertEqual(set(calc.winners()), {3, 5})
+        for candidate in calc.candidates:
+            self.assertIsInstance(candidate.keep_factor, int)
+
+
+@skipIf(stv.numpy is None, "numpy not installed")
+class StvMatrix(TestCase):
+    def test_matches_exact_count(self):
+        votes = synthetic_votes(1)
+        exact = StvCalculator({1, 2, 3, 4, 5}, votes, 2)
+        matrix = StvCalculator({1, 2, 3, 4, 5}, votes, 2, backend=BallotMatrix)
+        exact.full_election()
+        matrix.full_election()
+        self.assertIsInstance(matrix.arithmetic, FloatArithmetic)
+        self.assertEqual(set(exact.winners()), set(matrix.winners()))
+
+    def test_ambiguous_count_recounted_exactly(self):
+        # A tolerance this wide makes every close decision ambiguous
+        matrix = StvCalculator({1, 2, 3, 4, 5}, synthetic_votes(1), 2, backend=BallotMatrix,
+                               arithmetic=FloatArithmetic(tolerance=100))
+        matrix.withdraw({2})
+        matrix.full_election()
+        self.assertIsInstance(matrix.arithmetic, ExactArithmetic)
+        self.assertEqual(matrix.candidatedict[2].status, stv.States.WITHDRAWN)
+        self.assertEqual(set(matrix.winners()), {3, 5})
+
+
+class StvBenchmark(TestCase):
+    def test_distributions_are_seeded(self):
+        for generate in stv_benchmark.DISTRIBUTIONS.values():
+            self.assertEqual(generate(random.Random(3), 50, 5), generate(random.Random(3), 50, 5))
+
+    def test_run_reports_count(self):
+        result = stv_benchmark.run('clustered', 100, 5, 2, engine='fixed', memory=False)
+        self.assertEqual(result['arithmetic'], 'fixed(9)')
+        self.assertEqual(len(result['winners']), 2)
+        self.assertGreater(result['rounds'], 0)
+
+
+def stv_election(ballots, names="ABC", seats=1):
+    """Creates a closed STV election, with ballots given as tuples of indexes into names"""
+    election = Election.objects.create(name="AGM", description="", vote_type=Election.Types.STV, seats=seats)
+    candidates = [Candidate.objects.create(name=name, election=election) for name in names]
+    for prefs in ballots:
+        vote = STVVote.objects.create(election=election, uuid=uuid.uuid4())
+        # saved last preference first, so ordering has to come from the query
+        for order, i in reversed(list(enumerate(prefs, 1))):
+            STVPreference.objects.create(stvvote=vote, candidate=candidates[i], order=order)
+    return election, candidates
+
+
+class BallotLoading(TestCase):
+    def setUp(self):
+        self.election, (self.a, self.b, self.c) = stv_election([(0, 1), (1, 0, 2), (2,)])
+
+    def test_ballots_single_query(self):
+        with self.assertNumQueries(1):
+            ballots = list(self.election.ballots())
+        self.assertEqual(ballots, [(self.a.id, self.b.id), (self.b.id, self.a.id, self.c.id), (self.c.id,)])
+
+
+class BackgroundCount(TestCase):
+    def setUp(self):
+        self.election, self.candidates = stv_election([(0, 1)] * 3 + [(1, 2)] * 3 + [(2, 1)])
+
+    def test_single_result_counted_once(self):
+        result = enqueue_stv_count(self.election)
+        self.assertEqual(result.status, STVResult.Status.PENDING)
+        self.assertEqual(enqueue_stv_count(self.election).id, result.id)
+
+        result = count_stv(self.election.id)
+        self.assertEqual(result.status, STVResult.Status.DONE)
+        self.assertEqual(list(result.winners.all()), [self.candidates[1]])
+        # someone else got there first
+        self.assertIsNone(count_stv(self.election.id))
+        self.assertEqual(STVResult.objects.filter(election=self.election).count(), 1)
+
+    def test_stale_count_reclaimed(self):
+        result = enqueue_stv_count(self.election)
+        STVResult.objects.filter(id=result.id).update(status=STVResult.Status.RUNNING, started=timezone.now())
+        self.assertIsNone(count_stv(self.election.id))
+        # the process counting it died long enough ago
+        STVResult.objects.filter(id=result.id).update(
+            started=timezone.now() - STVResult.STALE_AFTER - timedelta(minutes=1))
+        self.assertTrue(STVResult.objects.get(id=result.id).stalled)
+        self.assertEqual(count_stv(self.election.id).status, STVResult.Status.DONE)
+
+    def test_long_count_keeps_claim(self):
+        result = enqueue_stv_count(self.election)
+        with mock.patch.object(tasks, 'HEARTBEAT', timedelta(0)):
+            self.assertEqual(count_stv(self.election.id).status, STVResult.Status.DONE)
+
+            def taken_over(election, after_round):
+                # another worker claims the count as soon as this one has started
+                STVResult.objects.filter(id=result.id).update(started=timezone.now() + timedelta(seconds=1))
+                return count(election, after_round)
+            count = tasks.tally
+            with mock.patch.object(tasks, 'tally', taken_over):
+                self.assertIsNone(count_stv(self.election.id, force=True))
+        self.assertEqual(STVResult.objects.get(id=result.id).status, STVResult.Status.RUNNING)
+
+    def test_background_failure_logged(self):
+        enqueue_stv_count(self.election)
+        with mock.patch.object(tasks, 'tally', side_effect=ValueError("no ballots")), \
+                mock.patch.object(tasks, 'connection'), self.assertLogs('votes.tasks', 'ERROR') as logs:
+            tasks._background_count(self.election.id)
+        self.assertIn("no ballots", logs.output[0])
+        self.assertEqual(STVResult.objects.get(election=self.election).status, STVResult.Status.FAILED)
+
+    def test_log_displayed(self):
+        count_stv(enqueue_stv_count(self.election).election_id)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        response = self.client.get(reverse('votes:stv_results', args=[self.election.id]), secure=True)
+        self.assertContains(response, 'Round 1')
+        response = self.client.get(reverse('votes:stv_log', args=[self.election.id]), {'format': 'text'}, secure=True)
+        self.assertContains(response, '**Election Results**')
+        self.assertEqual(response.content.decode(), STVResult.objects.get(election=self.election).log_text())
+
+    def test_command_recounts(self):
+        call_command('stv_count', self.election.id, stdout=io.StringIO())
+        self.assertEqual(self.election.stvresult.status, STVResult.Status.DONE)
+        STVResult.objects.filter(election=self.election).update(log=None)
+        call_command('stv_count', self.election.id, '--force', stdout=io.StringIO())
+        self.assertIsNotNone(STVResult.objects.get(election=self.election).log)
+
+
+class StvLog(TestCase):
+    def test_records_render_as_text(self):
+        calc = StvCalculator({1, 2, 3, 4, 5}, synthetic_votes(1), 2)
+        calc.full_election()
+        records = calc.log.records()
+        self.assertEqual(json.loads(json.dumps(records)), records)
+        self.assertEqual(stv.RoundLog.render(records), calc.fulllog)
+        self.assertEqual(sorted(records[-1]['elected']), [3, 5])
+        self.assertEqual(len([r for r in records if r['type'] == 'round']), calc.rounds - 1)
+
+    def test_logging_off(self):
+        calc = StvCalculator({1, 2, 3, 4, 5}, synthetic_votes(1), 2, log=False)
+        calc.full_election()
+        self.assertIsNone(calc.log)
+        self.assertEqual(calc.fulllog, [])
+        self.assertEqual(set(calc.winners()), {3, 5})
+
+
+class ResultTally(TestCase):
+    def setUp(self):
+        self.election = Election.objects.create(name="Chair", vote_type=Election.Types.FPTP, open=False)
+        self.a, self.b = (Candidate.objects.create(election=self.election, name=name) for name in "AB")
+        for choice in [self.b, self.b, self.a]:
+            FPTPVote.objects.create(election=self.election, selection=choice, uuid=uuid.uuid4())
+
+    def test_closed_tally_is_memoised(self):
+        with self.assertNumQueries(2):
+            tally = self.election.tally()
+        self.assertEqual(tally.turnout, 3)
+        self.assertEqual([(c.id, c.vote_count) for c in tally.choices], [(self.b.id, 2), (self.a.id, 1)])
+        with self.assertNumQueries(0):
+            self.election.tally()
+        FPTPVote.objects.filter(selection=self.b).first().delete()
+        self.assertEqual(self.election.tally().turnout, 2)
+
+    def test_edited_vote_forgotten(self):
+        self.election.tally()
+        vote = FPTPVote.objects.filter(selection=self.b).first()
+        vote.selection = self.a
+        vote.save()
+        self.assertEqual([(c.id, c.vote_count) for c in self.election.tally().choices],
+                         [(self.a.id, 2), (self.b.id, 1)])
+
+
+class TicketIssuance(TestCase):
+    def setUp(self):
+        self.members = [Member.objects.create(equiv_user=User.objects.create(username=name)) for name in "abc"]
+        self.elections = [Election.objects.create(name=name, vote_type=Election.Types.FPTP) for name in "XY"]
+
+    def test_skips_existing(self):
+        issue_tickets([self.members[0].id], self.elections[:1])
+        ids = [member.id for member in self.members]
+        # one query to find existing tickets, a bulk insert, a count of what was inserted
+        # and an update of each election's statistics by that much
+        with self.assertNumQueries(7):
+            self.assertEqual(issue_tickets(ids, self.elections), (5, 1))
+        self.assertEqual(Ticket.objects.count(), 6)
+        self.assertEqual(issue_tickets(ids, self.elections), (0, 6))
+        self.assertEqual([election.stats.tickets_issued for election in Election.objects.select_related('stats')],
+                         [3, 3])
+
+
+class ConcurrentVoting(TransactionTestCase):
+    voters = 20
+    attempts = 3
+
+    def setUp(self):
+        self.election = Election.objects.create(name="AGM", vote_type=Election.Types.STV, open=True)
+        self.candidates = [Candidate.objects.create(name=name, election=self.election).id for name in "ABC"]
+        self.tickets = [
+            Ticket.objects.create(member=Member.objects.create(equiv_user=User.objects.create(username=str(i))),
+                                  election=self.election)
+            for i in range(self.voters)]
+
+    def submit(self, ticket, outcomes, start):
+        start.wait()
+        try:
+            while True:
+                try:
+                    cast_stv(ticket, [(candidate, order) for order, candidate in enumerate(self.candidates, 1)])
+                    outcomes.append('cast')
+                    return
+                except AlreadyVoted:
+                    outcomes.append('rejected')
+                    return
+                except OperationalError:
+                    # SQLite locks the whole database, so a busy writer means try again
+                    time.sleep(0.001)
+        finally:
+            connection.close()
+
+    def test_each_ticket_spent_once(self):
+        outcomes = []
+        start = threading.Barrier(self.voters * self.attempts)
+        threads = [threading.Thread(target=self.submit, args=(Ticket.objects.get(id=ticket.id), outcomes, start))
+                   for ticket in self.tickets for _ in range(self.attempts)]
+        began = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        self.assertEqual(outcomes.count('cast'), self.voters)
+        self.assertEqual(outcomes.count('rejected'), self.voters * (self.attempts - 1))
+        self.assertEqual(STVVote.objects.filter(election=self.election).count(), self.voters)
+        self.assertEqual(STVPreference.objects.filter(stvvote__election=self.election).count(),
+                         self.voters * len(self.candidates))
+        self.assertFalse(Ticket.objects.filter(election=self.election, spent=False).exists())
+        # a generous bound, just to catch submissions serialising on something slow
+        self.assertLess(elapsed, 30, "{:.0f} ballots/s".format(len(threads) / elapsed))
+
+
+class StvTiebreaks(TestCase):
+    def test_tied_count_diverges(self):
+        report = stv_tiebreaks.analyse({1, 2, 3, 4}, [(1,), (2,), (3,), (4,)], 1, runs=200, workers=2)
+        self.assertEqual(report['tied_runs'], 200)
+        self.assertEqual(report['diverges_at'], 1)
+        self.assertEqual(sum(report['wins'].values()), 200)
+        self.assertTrue(all(report['wins'].values()))
+        # the same seeds give the same counts however they're shared out
+        self.assertEqual(stv_tiebreaks.analyse({1, 2, 3, 4}, [(1,), (2,), (3,), (4,)], 1, runs=200, workers=1), report)
+
+    def test_untied_count_agrees(self):
+        report = stv_tiebreaks.analyse({1, 2, 3, 4, 5}, synthetic_votes(1), 2, runs=5, workers=1)
+        self.assertEqual(report['outcomes'], {(3, 5): 5})
+        self.assertIsNone(report['diverges_at'])
+
+
+class Recounts(TestCase):
+    def setUp(self):
+        self.election, (self.a, self.b, self.c) = stv_election([(0, 1)] * 3 + [(1, 2)] * 3 + [(2, 1)])
+
+    def test_variants(self):
+        self.assertEqual(list(recount(self.election).winners()), [self.b.id])
+        self.assertEqual(set(recount(self.election, seats=2).winners()), {self.a.id, self.b.id})
+        self.assertEqual(list(recount(self.election, withdrawn={self.b.id}).winners()), [self.c.id])
+
+    def test_ballots_loaded_once(self):
+        recount(self.election)
+        with self.assertNumQueries(0):
+            recount(self.election, seats=2)
+            self.assertIs(recount(self.election, seats=2), recount(self.election, seats=2))
+
+    def test_unknown_withdrawn_refused(self):
+        with self.assertRaises(ValueError):
+            recount(self.election, withdrawn={self.c.id + 1})
+
+    def test_variants_bounded(self):
+        with mock.patch.object(recount_module, 'MAX_VARIANTS', 2):
+            first = recount(self.election, seed=1)
+            recount(self.election, seed=2)
+            self.assertIs(recount(self.election, seed=1), first)
+            recount(self.election, seed=3)
+            self.assertIs(recount(self.election, seed=1), first)
+            # seed 2 was the least recently used
+            self.assertEqual([seed for _, _, seed in recount_module._recounts[self.election.id].counts], [3, 1])
+
+    def test_open_elections_refused(self):
+        self.election.open = True
+        with self.assertRaises(ValueError):
+            recount(self.election)
+
+    def test_forgotten_on_close(self):
+        recount(self.election)
+        Election.objects.filter(id=self.election.id).update(open=True)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        self.client.post(reverse('votes:close'), secure=True)
+        election = Election.objects.get(id=self.election.id)
+        self.assertFalse(election.open)
+        # ballots read again
+        with self.assertNumQueries(3):
+            recount(election)
+
+    def test_ballot_set_checked(self):
+        with self.assertRaises(stv.ElectionError):
+            BallotSet({1, 2}, [(1, 2, 1)])
+        with self.assertRaises(stv.ElectionError):
+            BallotSet({1, 2}, [(1, 3)])
+
+
+class BltFiles(TestCase):
+    text = b"""3 2
+-3
+2 1 2 0
+1 2 0
+(x) 1 3 1 0
+0
+"Alice"
+"Bob"
+"Carol"
+"Chair"
+"""
+
+    def test_read_text(self):
+        reader = blt.BltReader(io.BytesIO(self.text))
+        self.assertEqual((reader.candidates, reader.seats, reader.withdrawn), (3, 2, {3}))
+        self.assertEqual(list(reader.ballots()), [(2, (1, 2)), (1, (2,)), (1, (3, 1))])
+        self.assertEqual((reader.names, reader.title), (["Alice", "Bob", "Carol"], "Chair"))
+
+    def test_round_trip(self):
+        for binary in (False, True):
+            file = io.BytesIO()
+            blt.write_blt(file, ["Alice", "Bob"], 1, [(3, (2, 1)), (1, ())], withdrawn=[1], title="Chair",
+                          binary=binary)
+            reader = blt.BltReader(io.BytesIO(file.getvalue()))
+            self.assertEqual(reader.binary, binary)
+            self.assertEqual(reader.withdrawn, {1})
+            self.assertEqual(reader.counts(), {(2, 1): 3, (): 1})
+            self.assertEqual(reader.names, ["Alice", "Bob"])
+
+    def test_long_binary_ballot_refused(self):
+        names = [str(i) for i in range(300)]
+        with self.assertRaises(blt.BltError):
+            blt.write_blt(io.BytesIO(), names, 1, [(1, tuple(range(1, 257)))], binary=True)
+
+    def test_malformed(self):
+        with self.assertRaises(blt.BltError):
+            list(blt.BltReader(io.BytesIO(b"2 1\n1 1=2 0\n0\n")).ballots())
+        with self.assertRaises(blt.BltError):
+            list(blt.BltReader(io.BytesIO(b"2 1\n1 3 0\n0\n")).ballots())
+        for withdrawn in (b"-3", b"-0", b"-x"):
+            with self.assertRaises(blt.BltError):
+                blt.BltReader(io.BytesIO(b"2 1\n" + withdrawn + b"\n1 1 0\n0\n"))
+
+    def test_election_round_trip(self):
+        election, (a, b, c) = stv_election([(0, 1)] * 3 + [(1, 2)] * 3 + [(2, 1)])
+        file = io.BytesIO()
+        blt.export_election(election, file, binary=True)
+        imported = blt.import_election(io.BytesIO(file.getvalue()), batch_size=2)
+        self.assertEqual(imported.name, "AGM")
+        self.assertEqual(list(imported.candidate_set.values_list('name', flat=True)), ["A", "B", "C"])
+        names = dict(imported.candidate_set.values_list('id', 'name'))
+        self.assertEqual([tuple(names[i] for i in ballot) for ballot in imported.ballots()],
+                         [("A", "B")] * 3 + [("B", "C")] * 3 + [("C", "B")])
+        self.assertEqual(ElectionStats.objects.get(election=imported).votes_cast, 7)
+
+    def test_empty_ballots_round_trip(self):
+        for binary in (False, True):
+            file = io.BytesIO()
+            blt.write_blt(file, ["Alice", "Bob"], 1, [(2, (1,)), (3, ())], binary=binary)
+            election = blt.import_election(io.BytesIO(file.getvalue()))
+            self.assertEqual(ElectionStats.objects.get(election=election).votes_cast, 5)
+            exported = io.BytesIO()
+            blt.export_election(election, exported, binary=binary)
+            self.assertEqual(blt.BltReader(io.BytesIO(exported.getvalue())).counts(), {(1,): 2, (): 3})
+
+    def test_count_command(self):
+        file = tempfile.NamedTemporaryFile(suffix='.blt')
+        file.write(self.text)
+        file.flush()
+        out = io.StringIO()
+        call_command('blt_count', file.name, stdout=out)
+        self.assertIn("Chair: 4 ballots", out.getvalue())
+        self.assertEqual(out.getvalue().splitlines()[1:], ["Alice", "Bob"])
+
+        file = tempfile.NamedTemporaryFile(suffix='.blt')
+        file.write(b"two seats\n")
+        file.flush()
+        with self.assertRaises(CommandError):
+            call_command('blt_count', file.name, stdout=io.StringIO())
+
+
+@skipIf(stv.numpy is None, "numpy not installed")
+class PairwiseAnalysis(TestCase):
+    # https://en.wikipedia.org/wiki/Schulze_method#Example
+    ballots = [(1, 3, 2, 5, 4)] * 5 + [(1, 4, 5, 3, 2)] * 5 + [(2, 5, 4, 1, 3)] * 8 + [(3, 1, 2, 5, 4)] * 3 + \
+              [(3, 1, 5, 2, 4)] * 7 + [(3, 2, 1, 4, 5)] * 2 + [(4, 3, 5, 2, 1)] * 7 + [(5, 2, 1, 4, 3)] * 8
+
+    def test_schulze_example(self):
+        result = pairwise.Pairwise({1, 2, 3, 4, 5}, self.ballots)
+        self.assertEqual(result.matrix[0].tolist(), [0, 20, 26, 30, 22])
+        self.assertEqual(result.strongest[4].tolist(), [25, 28, 28, 31, 0])
+        self.assertIsNone(result.condorcet_winner())
+        self.assertEqual(result.schulze_winners(), [5])
+        self.assertEqual([c for c, _ in result.schulze_ranking()], [5, 1, 3, 2, 4])
+
+    def test_unranked_and_skipped(self):
+        result = pairwise.Pairwise({1, 2, 3}, [(1,), (2, 4, 1), (4,)])
+        self.assertEqual(result.matrix.tolist(), [[0, 1, 2], [1, 0, 1], [0, 0, 0]])
+        self.assertIsNone(result.condorcet_winner())
+
+    def test_tab(self):
+        election, _ = stv_election([(0, 1)] * 3 + [(1, 2)] * 3 + [(2, 1)])
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        response = self.client.get(reverse('votes:stv_pairwise', args=[election.id]), secure=True)
+        self.assertEqual(response.context['condorcet_winner'], "B")
+        self.assertContains(response, ">Pairwise</a>")
+
+
+class PairwiseWithoutNumpy(TestCase):
+    def test_tab_hidden(self):
+        election, _ = stv_election([(0, 1)] * 3 + [(1, 2)])
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        with mock.patch.object(pairwise, 'numpy', None):
+            response = self.client.get(reverse('votes:stv_results', args=[election.id]), secure=True)
+            self.assertNotContains(response, ">Pairwise</a>")
+            response = self.client.get(reverse('votes:stv_pairwise', args=[election.id]), secure=True)
+            self.assertEqual(response.status_code, 404)
+
+
+class Turnout(TestCase):
+    def setUp(self):
+        self.election, self.candidates = stv_election([(0, 1)])
+        self.election.open = True
+        self.election.save()
+        self.members = [Member.objects.create(equiv_user=User.objects.create(username=name)) for name in "ab"]
+
+    def test_stats_follow_tickets_and_votes(self):
+        issue_tickets([member.id for member in self.members], [self.election])
+        cast_stv(Ticket.objects.get(member=self.members[0]), [(self.candidates[0].id, 1)])
+        stats = ElectionStats.objects.get(election=self.election)
+        self.assertEqual((stats.tickets_issued, stats.tickets_spent, stats.votes_cast), (2, 1, 1))
+        self.assertIsNotNone(stats.last_vote)
+        # stv_election saved its ballot directly, which only a rebuild notices
+        self.assertEqual(ElectionStats.rebuild(self.election.id).votes_cast, 2)
+
+    def test_dashboard_queries_independent_of_turnout(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        url = reverse('votes:turnout')
+        # the first page view sets up the session and site settings
+        self.client.get(url, secure=True)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url, secure=True)
+        issue_tickets([member.id for member in self.members], [self.election])
+        cast_stv(Ticket.objects.get(member=self.members[0]), [(self.candidates[0].id, 1)])
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(url, secure=True)
+        self.assertContains(response, "50%")
+        self.assertEqual(len(before), len(after))
+        self.assertContains(self.client.get(reverse('votes:admin'), secure=True), "&le; 5")
+
+    def test_admin_deletes_counted(self):
+        issue_tickets([member.id for member in self.members], [self.election])
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        ticket = Ticket.objects.get(member=self.members[0])
+        self.client.post(reverse('admin:votes_ticket_delete', args=[ticket.id]), {'post': 'yes'}, secure=True)
+        self.assertEqual(ElectionStats.objects.get(election=self.election).tickets_issued, 1)
+
+    def test_vote_count_without_stats(self):
+        ElectionStats.objects.filter(election=self.election).delete()
+        election = Election.objects.get(id=self.election.id)
+        self.assertEqual(sanitized_vote_count(election), "&le; 5")
@@ -0,0 +1,46 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Ticket, ElectionStats
+
+"""
+Set based ticket issuance
+
+Issuing tickets one get_or_create at a time costs a few queries per member per election,
+which adds up to thousands when the whole membership is given tickets for several ballots.
+"""
+
+BATCH_SIZE = 500
+
+
+def issue_tickets(member_ids, elections, batch_size=BATCH_SIZE):
+    """
+    Gives every member a ticket for every election, leaving existing tickets alone.
+    Returns (created, skipped), skipped being the number of tickets members already had.
+    """
+    member_ids = set(member_ids)
+    election_ids = {election.id for election in elections}
+    if not member_ids or not election_ids:
+        return 0, 0
+
+    existing = set(Ticket.objects.filter(member_id__in=member_ids, election_id__in=election_ids)
+                   .values_list('member_id', 'election_id'))
+    missing = [Ticket(member_id=member_id, election_id=election_id)
+               for member_id in member_ids for election_id in election_ids
+               if (member_id, election_id) not in existing]
+
+    with transaction.atomic():
+        # the unique constraint quietly drops any ticket issued by someone else in the meantime,
+        # so what was actually inserted is counted afterwards rather than assumed
+        Ticket.objects.bulk_create(missing, batch_size=batch_size, ignore_conflicts=True)
+        held = Counter(election_id for _, election_id in existing)
+        issued = Ticket.objects.filter(member_id__in=member_ids, election_id__in=election_ids).order_by() \
+            .values_list('election_id').annotate(n=Count('id'))
+        created = 0
+        for election_id, n in issued:
+            if n > held[election_id]:
+                ElectionStats.add(election_id, tickets_issued=n - held[election_id])
+                created += n - held[election_id]
+    return created, len(existing)
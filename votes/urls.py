@@ -3,7 +3,7 @@ from django.urls import path
 from .views import ApprovalVoteView, DoneView, ApprovalResultView, HomeView, VoteView, FPTPResultView, FPTPVoteView, \
     STVVoteView, STVResultView, UpdateElection, CreateElection, CreateCandidate, UpdateCandidate, AdminView, TicketView, \
     ResultView, IDTicketView, DateTicketView, STVAllVoteView, AllTicketView, UsernameTicketView, UserTicketView, \
-    DeleteTicketView, ResetVoteView, CloseElectionView
+    DeleteTicketView, ResetVoteView, CloseElectionView, ResultExportView, STVLogView, STVPairwiseView, TurnoutView
 
 app_name = "votes"
 
@@ -20,6 +20,12 @@ urlpatterns = [
          ApprovalResultView.as_view(), name="approval_results"),
     path('<int:election>/results/fptp/',
          FPTPResultView.as_view(), name="fptp_results"),
+    path('<int:election>/results/export/',
+         ResultExportView.as_view(), name="results_export"),
+    path('<int:election>/results/stv/pairwise/',
+         STVPairwiseView.as_view(), name="stv_pairwise"),
+    path('<int:election>/results/stv/log/',
+         STVLogView.as_view(), name="stv_log"),
     path('<int:election>/results/stv/',
          STVResultView.as_view(), name="stv_results"),
     path('<int:election>/results/stv/votes/',
@@ -42,5 +48,6 @@ urlpatterns = [
          CreateCandidate.as_view(), name="create_candidate"),
     path('admin/edit/<int:election>/edit/<int:candidate>/',
          UpdateCandidate.as_view(), name="update_candidate"),
+    path('admin/turnout/', TurnoutView.as_view(), name="turnout"),
     path('admin/close_all/', CloseElectionView.as_view(), name="close"),
 ]
@@ -1,25 +1,32 @@
+import csv
 import random
-from operator import itemgetter, attrgetter
+from operator import itemgetter
 
 from django.contrib.messages import add_message
 from django.contrib.messages import constants as messages
 from django.db import transaction, DatabaseError
 from django.shortcuts import render, Http404
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Count, Q
+from django.db.models.functions import Lower
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
 from django.urls import reverse_lazy
 from django.views.generic import View, TemplateView, ListView, DetailView, RedirectView, CreateView, UpdateView, \
     FormView
 from django.shortcuts import get_object_or_404, HttpResponseRedirect, reverse
+from django.http import HttpResponse, JsonResponse
 
 from users.permissions import PERMS
 
 from users.models import Membership, Member
 from .forms import ElectionForm, CandidateForm, DateTicketForm, IDTicketForm, UsernameTicketForm, AllTicketForm, \
     MemberTicketForm, DeleteTicketForm, ResetVoteForm, NullForm
-from .models import Election, STVVote, STVPreference, FPTPVote, APRVVote, Candidate, Ticket, Vote, STVResult
-from .stv import Election as StvCalculator
+from .models import Election, STVVote, STVPreference, FPTPVote, APRVVote, Candidate, Ticket, Vote, STVResult, \
+    ElectionStats
+from .ballots import cast_fptp, cast_approval, cast_stv, AlreadyVoted
+from .pairwise import Pairwise, available as pairwise_available
+from .tasks import enqueue_stv_count
+from .recount import forget_recount
+from .tickets import issue_tickets
 
 
 # Create your views here.
@@ -49,47 +56,64 @@ class AdminView(PermissionRequiredMixin, ListView):
 
     def get_context_data(self, *args, **kwargs):
         ctxt = super().get_context_data(*args, **kwargs)
-        ctxt['open_elections'] = self.get_queryset().filter(open=True)
-        ctxt['closed_elections'] = self.get_queryset().filter(
-            Q(stvvote__isnull=False) | Q(aprvvote__isnull=False) | Q(fptpvote__isnull=False),
-            open=False).distinct()
+        ensure_stats(self.get_queryset())
+        ctxt['open_elections'] = self.get_queryset().filter(open=True).select_related('stats')
+        ctxt['closed_elections'] = self.get_queryset().filter(open=False, stats__votes_cast__gt=0).select_related('stats')
         return ctxt
 
 
+def ensure_stats(elections):
+    # Only elections from before statistics were kept can be missing them
+    for election_id in elections.filter(stats__isnull=True).values_list('id', flat=True):
+        ElectionStats.rebuild(election_id)
+
+
+class TurnoutView(PermissionRequiredMixin, ListView):
+    template_name = "votes/turnout.html"
+    permission_required = PERMS.votes.view_election
+    context_object_name = "elections"
+
+    def get_queryset(self):
+        elections = Election.objects.filter(archived=False)
+        ensure_stats(elections)
+        return elections.select_related('stats').order_by('-open', 'id')
+
+
 class TicketView(PermissionRequiredMixin, TemplateView):
     permission_required = PERMS.votes.add_ticket
     template_name = "votes/ticket.html"
 
 
-class IDTicketView(PermissionRequiredMixin, FormView):
+class IssueTicketMixin:
+    def issue_tickets(self, member_ids, elections):
+        created, skipped = issue_tickets(member_ids, elections)
+        add_message(self.request, messages.SUCCESS,
+                    "Issued {} tickets ({} already issued)".format(created, skipped))
+
+
+class IDTicketView(PermissionRequiredMixin, IssueTicketMixin, FormView):
     permission_required = PERMS.votes.add_ticket
     form_class = IDTicketForm
     template_name = "votes/tickets.html"
     success_url = reverse_lazy('votes:admin')
 
     def form_valid(self, form):
-        for uniid in form.cleaned_data['ids'].split():
-            try:
-                membership = Membership.objects.get(uni_id=uniid.lstrip('u'))
-                for election in form.cleaned_data['elections']:
-                    Ticket.objects.get_or_create(
-                        member_id=membership.member_id, election=election)
-            except Membership.DoesNotExist:
-                pass
+        uniids = [uniid.lstrip('u') for uniid in form.cleaned_data['ids'].split()]
+        member_ids = Membership.objects.filter(uni_id__in=uniids).values_list('member_id', flat=True)
+        self.issue_tickets(member_ids, form.cleaned_data['elections'])
         return super().form_valid(form)
 
 
-class DateTicketView(PermissionRequiredMixin, FormView):
+class DateTicketView(PermissionRequiredMixin, IssueTicketMixin, FormView):
     permission_required = PERMS.votes.add_ticket
     form_class = DateTicketForm
     template_name = "votes/tickets.html"
     success_url = reverse_lazy('votes:admin')
 
     def form_valid(self, form):
-        for membership in Membership.objects.filter(checked__lte=form.cleaned_data['date'], active=True):
-            for election in form.cleaned_data['elections']:
-                Ticket.objects.get_or_create(
-                    member_id=membership.member_id, election=election)
+        member_ids = Membership.objects.filter(checked__lte=form.cleaned_data['date'], active=True) \
+            .values_list('member_id', flat=True)
+        self.issue_tickets(member_ids, form.cleaned_data['elections'])
         return super().form_valid(form)
 
 
@@ -102,53 +126,44 @@ class DeleteTicketView(PermissionRequiredMixin, FormView):
     def form_valid(self, form):
         for election in form.cleaned_data['elections']:
             Ticket.objects.filter(election=election).delete()
+            ElectionStats.rebuild(election.id)
         return super().form_valid(form)
 
 
-class AllTicketView(PermissionRequiredMixin, FormView):
+class AllTicketView(PermissionRequiredMixin, IssueTicketMixin, FormView):
     permission_required = PERMS.votes.add_ticket
     form_class = AllTicketForm
     template_name = "votes/tickets.html"
     success_url = reverse_lazy('votes:admin')
 
     def form_valid(self, form):
-        for member in Member.objects.filter(equiv_user__is_active=True):
-            for election in form.cleaned_data['elections']:
-                Ticket.objects.get_or_create(
-                    member_id=member.id, election=election)
+        member_ids = Member.objects.filter(equiv_user__is_active=True).values_list('id', flat=True)
+        self.issue_tickets(member_ids, form.cleaned_data['elections'])
         return super().form_valid(form)
 
 
-class UsernameTicketView(PermissionRequiredMixin, FormView):
+class UsernameTicketView(PermissionRequiredMixin, IssueTicketMixin, FormView):
     permission_required = PERMS.votes.add_ticket
     form_class = UsernameTicketForm
     template_name = "votes/tickets.html"
     success_url = reverse_lazy('votes:admin')
 
     def form_valid(self, form):
-        for username in form.cleaned_data['ids'].split():
-            try:
-                member = Member.objects.get(
-                    equiv_user__username__iexact=username.strip())
-                for election in form.cleaned_data['elections']:
-                    Ticket.objects.get_or_create(
-                        member_id=member.id, election=election)
-            except Member.DoesNotExist:
-                pass
+        usernames = [username.lower() for username in form.cleaned_data['ids'].split()]
+        member_ids = Member.objects.annotate(lower_username=Lower('equiv_user__username')) \
+            .filter(lower_username__in=usernames).values_list('id', flat=True)
+        self.issue_tickets(member_ids, form.cleaned_data['elections'])
         return super().form_valid(form)
 
 
-class UserTicketView(PermissionRequiredMixin, FormView):
+class UserTicketView(PermissionRequiredMixin, IssueTicketMixin, FormView):
     permission_required = PERMS.votes.add_ticket
     form_class = MemberTicketForm
     template_name = "votes/tickets.html"
     success_url = reverse_lazy('votes:admin')
 
     def form_valid(self, form):
-        for member in form.cleaned_data['members']:
-            for election in form.cleaned_data['elections']:
-                Ticket.objects.get_or_create(
-                    member_id=member.id, election=election)
+        self.issue_tickets([member.id for member in form.cleaned_data['members']], form.cleaned_data['elections'])
         return super().form_valid(form)
 
 
@@ -174,6 +189,7 @@ class ResetVoteView(PermissionRequiredMixin, FormView):
                 vote.delete()
                 ticket.spent = False
                 ticket.save()
+                ElectionStats.rebuild(ticket.election_id)
         except DatabaseError:
             add_message(self.request, messages.ERROR, "Unable to delete vote")
 
@@ -187,7 +203,14 @@ class CloseElectionView(PermissionRequiredMixin, FormView):
     success_url = reverse_lazy('votes:admin')
 
     def form_valid(self, form):
+        closing = list(Election.objects.filter(open=True, archived=False))
         Election.objects.filter(open=True, archived=False).update(open=False)
+        for election in closing:
+            # update() sends no signals
+            forget_recount(election.id)
+            # Start counting now so the results are ready by the time anyone looks
+            if election.vote_type == Election.Types.STV:
+                enqueue_stv_count(election)
         add_message(self.request, messages.SUCCESS, "All votes closed")
         return super().form_valid(form)
 
@@ -299,7 +322,6 @@ class ApprovalResultView(PermissionRequiredMixin, ListView):
     model = Candidate
     permission_required = PERMS.votes.view_aprvvote
     template_name = "votes/approval_results.html"
-    ordering = [Count("aprvvotes_set")]
     context_object_name = "choices"
 
     def get_queryset(self):
@@ -311,12 +333,36 @@ class ApprovalResultView(PermissionRequiredMixin, ListView):
     def get_context_data(self, **kwargs):
         ctxt = super().get_context_data(**kwargs)
         ctxt['election'] = self.election
-        ctxt['choices'] = sorted(
-            ctxt['choices'], key=lambda x: -x.votes().count())
+        ctxt['tally'] = self.election.tally()
+        ctxt['choices'] = ctxt['tally'].choices
         return ctxt
 
 
-class ApprovalVoteView(UserPassesTestMixin, TemplateView):
+class ResultExportView(PermissionRequiredMixin, View):
+    permission_required = PERMS.votes.view_election
+
+    def get(self, request, *args, **kwargs):
+        election = get_object_or_404(Election, id=self.kwargs['election'], open=False,
+                                     vote_type__in=[Election.Types.FPTP, Election.Types.APRV])
+        tally = election.tally()
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="election-{}.csv"'.format(election.id)
+        writer = csv.writer(response)
+        writer.writerow(['Candidate', 'Votes'])
+        for choice in tally.choices:
+            writer.writerow([choice.name, choice.vote_count])
+        writer.writerow(['Turnout', tally.turnout])
+        return response
+
+
+class CastVoteMixin:
+    def already_voted(self):
+        # Another submission with the same ticket got there first
+        add_message(self.request, messages.ERROR, "You have already voted in this election")
+        return HttpResponseRedirect(reverse("votes:elections"))
+
+
+class ApprovalVoteView(UserPassesTestMixin, CastVoteMixin, TemplateView):
     template_name = "votes/approval_votescreen.html"
 
     def test_func(self):
@@ -350,16 +396,10 @@ class ApprovalVoteView(UserPassesTestMixin, TemplateView):
         if errors:
             return self.get(request, errors=errors)
         else:
-            vote = APRVVote(
-                uuid=ticket.uuid,
-                election=self.election,
-            )
-            vote.save()
-            vote.selection.add(*selection)
-
-            ticket.spent = True
-            ticket.save()
-
+            try:
+                vote = cast_approval(ticket, selection)
+            except AlreadyVoted:
+                return self.already_voted()
             return HttpResponseRedirect(
                 reverse("votes:vote_done", kwargs={'election': self.election.id, 'slug': vote.uuid}))
 
@@ -377,7 +417,6 @@ class FPTPResultView(PermissionRequiredMixin, ListView):
     model = Candidate
     permission_required = PERMS.votes.view_fptpvote
     template_name = "votes/fptp_results.html"
-    ordering = [Count("fptpvotes_set")]
     context_object_name = "choices"
 
     def get_queryset(self):
@@ -389,12 +428,12 @@ class FPTPResultView(PermissionRequiredMixin, ListView):
     def get_context_data(self, **kwargs):
         ctxt = super().get_context_data(**kwargs)
         ctxt['election'] = self.election
-        ctxt['choices'] = sorted(
-            ctxt['choices'], key=lambda x: -x.votes().count())
+        ctxt['tally'] = self.election.tally()
+        ctxt['choices'] = ctxt['tally'].choices
         return ctxt
 
 
-class FPTPVoteView(UserPassesTestMixin, TemplateView):
+class FPTPVoteView(UserPassesTestMixin, CastVoteMixin, TemplateView):
     template_name = "votes/fptp_votescreen.html"
 
     def test_func(self):
@@ -429,16 +468,10 @@ class FPTPVoteView(UserPassesTestMixin, TemplateView):
         if errors:
             return self.get(request, errors=errors)
         else:
-            vote = FPTPVote(
-                uuid=ticket.uuid,
-                election=self.election,
-                selection_id=selection
-            )
-            vote.save()
-
-            ticket.spent = True
-            ticket.save()
-
+            try:
+                vote = cast_fptp(ticket, selection)
+            except AlreadyVoted:
+                return self.already_voted()
             return HttpResponseRedirect(
                 reverse("votes:vote_done", kwargs={'election': self.election.id,
                                                    'slug': vote.uuid}))
@@ -469,34 +502,50 @@ class STVResultView(PermissionRequiredMixin, ListView):
     def get_context_data(self, **kwargs):
         ctxt = super().get_context_data(**kwargs)
         ctxt['election'] = self.election
-        try:
-            res = self.election.stvresult
-        except STVResult.DoesNotExist:
-            candidates = set(
-                map(attrgetter('id'), self.election.candidate_set.all()))
-            withdrawn = set(
-                map(attrgetter('id'), self.election.candidate_set.filter(
-                    state=Candidate.State.WITHDRAWN)))
-            votes = []
-            for i in self.election.stvvote_set.all():
-                vote = []
-                for j in STVPreference.objects.filter(stvvote=i).order_by(
-                        'order'):
-                    vote.append(int(j.candidate_id))
-                votes.append(tuple(vote))
-
-            calc = StvCalculator(candidates, votes, self.election.seats)
-            calc.withdraw(withdrawn)
-            calc.full_election()
-            res = STVResult.objects.create(
-                election=self.election, full_log="\n".join(calc.fulllog))
-            res.save()
-            res.winners.add(*Candidate.objects.filter(id__in=calc.winners()))
-        ctxt['result'] = res
+        ctxt['result'] = enqueue_stv_count(self.election)
+        ctxt['pairwise_available'] = pairwise_available()
         return ctxt
 
 
-class STVVoteView(UserPassesTestMixin, TemplateView):
+class STVPairwiseView(PermissionRequiredMixin, TemplateView):
+    permission_required = PERMS.votes.view_stvvote
+    template_name = "votes/stv_pairwise.html"
+
+    def get_context_data(self, **kwargs):
+        if not pairwise_available():
+            raise Http404("Pairwise analysis needs numpy")
+        ctxt = super().get_context_data(**kwargs)
+        self.election = get_object_or_404(Election, id=self.kwargs['election'],
+                                          vote_type=Election.Types.STV,
+                                          open=False)
+        ctxt['election'] = self.election
+        ctxt['pairwise_available'] = True
+        standing = self.election.candidate_set.exclude(state=Candidate.State.WITHDRAWN)
+        names = dict(standing.values_list('id', 'name'))
+        pairwise = Pairwise(set(names), self.election.ballots())
+        ctxt['names'] = [names[candidate] for candidate in pairwise.candidates]
+        ctxt['rows'] = [
+            (names[a], [(pairwise.matrix[i, j], pairwise.beats(i, j), pairwise.strongest[i, j], i == j)
+                        for j in range(len(pairwise.candidates))])
+            for i, a in enumerate(pairwise.candidates)]
+        winner = pairwise.condorcet_winner()
+        ctxt['condorcet_winner'] = winner and names[winner]
+        ctxt['schulze_winners'] = [names[candidate] for candidate in pairwise.schulze_winners()]
+        ctxt['schulze_ranking'] = [(names[candidate], wins) for candidate, wins in pairwise.schulze_ranking()]
+        return ctxt
+
+
+class STVLogView(PermissionRequiredMixin, View):
+    permission_required = PERMS.votes.view_stvvote
+
+    def get(self, request, *args, **kwargs):
+        result = get_object_or_404(STVResult, election_id=self.kwargs['election'], status=STVResult.Status.DONE)
+        if request.GET.get('format') == 'text':
+            return HttpResponse(result.log_text(), content_type='text/plain')
+        return JsonResponse({'election': result.election_id, 'log': result.log})
+
+
+class STVVoteView(UserPassesTestMixin, CastVoteMixin, TemplateView):
     template_name = "votes/stv_votescreen.html"
 
     def test_func(self):
@@ -552,18 +601,10 @@ class STVVoteView(UserPassesTestMixin, TemplateView):
         if errors:
             return self.get(request, errors=set(errors), previous=request.POST)
         else:
-            vote = STVVote(
-                uuid=ticket.uuid,
-                election=self.election,
-            )
-            vote.save()
-            for i in selection:
-                STVPreference.objects.create(
-                    stvvote=vote, candidate_id=i[0], order=i[1])
-
-            ticket.spent = True
-            ticket.save()
-
+            try:
+                vote = cast_stv(ticket, selection)
+            except AlreadyVoted:
+                return self.already_voted()
             return HttpResponseRedirect(
                 reverse("votes:vote_done",
                         kwargs={'election': self.election.id,